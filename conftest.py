@@ -0,0 +1,44 @@
+"""
+Shared fixtures for the offline test suites (no Gemini or Firebase calls).
+
+Plain helpers rather than pytest fixtures, so the unittest-style test classes
+can use them under both pytest and python -m unittest.
+"""
+from langchain_persona_architect import (
+    LangChainPersonaArchitect,
+    LiveUserState,
+    PersonalityProfile,
+    UserPersona,
+)
+
+
+PROFILE = {
+    "communication_style": "logical",
+    "primary_stressor": "sleep",
+    "social_profile": "introverted",
+    "coping_mechanism": "mixed",
+    "stress_level": "low",
+    "strengths": ["curious", "organised"],
+    "vulnerabilities": ["overthinking", "perfectionism"],
+    "recommended_approach": "Practical, step-by-step support",
+    "chatbot_tone": "calm",
+    "chatbot_methodology": "CBT-informed",
+    "proactive_triggers": ["late nights", "deadlines"],
+    "chatbot_system_prompt": "Serebot is a wellness companion, not a therapist.",
+}
+
+QUIZ = {q_id: "a" for q_id in range(1, 11)}
+
+
+def make_architect() -> LangChainPersonaArchitect:
+    """Architect with a dummy key; tests swap fakes in for its chains"""
+    return LangChainPersonaArchitect(google_api_key="test-key")
+
+
+def make_persona(**state_fields) -> UserPersona:
+    """Persona built from PROFILE with a freshly stamped live state"""
+    return UserPersona(
+        user_id="user-1",
+        personality_profile=PersonalityProfile(**PROFILE),
+        live_user_state=LiveUserState.fresh(**state_fields),
+    )
@@ -7,8 +7,11 @@ Stores user_persona collection with references to user IDs from auth.
 
 import os
 import json
-from typing import Optional, Dict, Any, List
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple
+from datetime import datetime, timedelta, timezone
 import firebase_admin
 from firebase_admin import credentials, firestore
 from dotenv import load_dotenv
@@ -17,6 +20,15 @@ from langchain_persona_architect import UserPersona, LiveUserState
 # Load environment variables from .env file
 load_dotenv()
 
+# Personas are read on every chat turn but change rarely; cache them per
+# process. Writes through this service refresh the cache, so the TTL only
+# bounds staleness from writes made by other instances.
+PERSONA_CACHE_TTL_SECONDS = float(os.getenv("PERSONA_CACHE_TTL_SECONDS", "60"))
+PERSONA_CACHE_MAX_ENTRIES = 1000
+
+# Live-state counters written as server-side increments by update_live_state
+_LIVE_STATE_COUNTERS = frozenset({"chat_message_count", "tool_usage_count", "sleep_logs_count"})
+
 
 class FirebaseService:
     """Service class for Firebase Firestore operations"""
@@ -35,6 +47,8 @@ class FirebaseService:
         if not self._initialized:
             self._initialize_firebase()
             self.db = firestore.client()
+            self._persona_cache: "OrderedDict[str, Tuple[float, UserPersona]]" = OrderedDict()
+            self._persona_cache_lock = threading.Lock()
             
             FirebaseService._initialized = True
     
@@ -102,6 +116,38 @@ class FirebaseService:
         except Exception as e:
             raise RuntimeError(f"❌ Failed to initialize Firebase: {e}")
 
+    # ========================================================================
+    # USER PERSONA CACHE
+    # ========================================================================
+    
+    def _get_cached_persona(self, user_id: str) -> Optional[UserPersona]:
+        """Return a private copy of a fresh cached persona, or None"""
+        with self._persona_cache_lock:
+            entry = self._persona_cache.get(user_id)
+            if entry is None:
+                return None
+            cached_at, persona = entry
+            if time.monotonic() - cached_at > PERSONA_CACHE_TTL_SECONDS:
+                del self._persona_cache[user_id]
+                return None
+            self._persona_cache.move_to_end(user_id)
+        # Callers mutate live_user_state in place, so never hand out the cached object
+        return persona.model_copy(deep=True)
+    
+    def _cache_persona(self, persona: UserPersona):
+        """Store a copy of the persona, evicting the least recently used entry when full"""
+        snapshot = persona.model_copy(deep=True)
+        with self._persona_cache_lock:
+            self._persona_cache[persona.user_id] = (time.monotonic(), snapshot)
+            self._persona_cache.move_to_end(persona.user_id)
+            while len(self._persona_cache) > PERSONA_CACHE_MAX_ENTRIES:
+                self._persona_cache.popitem(last=False)
+    
+    def invalidate_persona_cache(self, user_id: str):
+        """Drop a user's cached persona so the next read goes to Firestore"""
+        with self._persona_cache_lock:
+            self._persona_cache.pop(user_id, None)
+    
     # ========================================================================
     # USER PERSONA OPERATIONS
     # ========================================================================
@@ -119,8 +165,8 @@ class FirebaseService:
             bool: True if successful, False otherwise
         """
         try:
-            # Convert persona to dictionary
-            persona_dict = persona.model_dump()
+            # Convert persona to a JSON-native dictionary (enums -> str)
+            persona_dict = persona.model_dump(mode="json")
             
             # Add/update metadata
             persona_dict["updated_at"] = firestore.SERVER_TIMESTAMP
@@ -129,24 +175,35 @@ class FirebaseService:
             # Save to Firestore: user_persona/{user_id}
             doc_ref = self.db.collection("user_persona").document(persona.user_id)
             doc_ref.set(persona_dict, merge=True)
+            self._cache_persona(persona)
             
             print(f"✅ Saved persona for user {persona.user_id}")
             return True
             
         except Exception as e:
+            # The write may still have landed; make the next read go to Firestore
+            self.invalidate_persona_cache(persona.user_id)
             print(f"❌ Error saving persona for user {persona.user_id}: {e}")
             return False
     
-    def get_user_persona(self, user_id: str) -> Optional[UserPersona]:
+    def get_user_persona(self, user_id: str, use_cache: bool = True) -> Optional[UserPersona]:
         """
         Retrieve user persona from Firestore.
         
         Args:
             user_id: User ID from Firebase Authentication
+            use_cache: Serve a cached copy (up to PERSONA_CACHE_TTL_SECONDS old)
+                when available. Pass False when the persona will be modified
+                and written back, so the update starts from Firestore's copy.
         
         Returns:
             UserPersona object if found, None otherwise
         """
+        if use_cache:
+            cached = self._get_cached_persona(user_id)
+            if cached is not None:
+                return cached
+        
         try:
             doc_ref = self.db.collection("user_persona").document(user_id)
             doc = doc_ref.get()
@@ -161,8 +218,9 @@ class FirebaseService:
             persona_dict.pop("updated_at", None)
             persona_dict.pop("version", None)
             
-            # Convert to UserPersona object
-            persona = UserPersona(**persona_dict)
+            # Convert to UserPersona object (reuses the model's compiled validator)
+            persona = UserPersona.model_validate(persona_dict)
+            self._cache_persona(persona)
             
             print(f"✅ Retrieved persona for user {user_id}")
             return persona
@@ -171,15 +229,25 @@ class FirebaseService:
             print(f"❌ Error retrieving persona for user {user_id}: {e}")
             return None
     
-    def update_live_state(self, user_id: str, live_state: LiveUserState) -> bool:
+    def update_live_state(
+        self,
+        user_id: str,
+        live_state: LiveUserState,
+        previous_state: Optional[Dict[str, Any]] = None
+    ) -> bool:
         """
         Update only the live_user_state portion of a persona.
         
         More efficient than updating entire persona when only state changes.
+        When the pre-update state is supplied, only the fields that changed are
+        written (as dotted `live_user_state.<field>` paths), with counters sent
+        as increments so concurrent updates to the same user are not lost.
         
         Args:
             user_id: User ID from Firebase Authentication
             live_state: Updated LiveUserState object
+            previous_state: live_state.model_dump(mode="json") taken before the
+                update, from a persona read with use_cache=False
         
         Returns:
             bool: True if successful, False otherwise
@@ -187,16 +255,37 @@ class FirebaseService:
         try:
             doc_ref = self.db.collection("user_persona").document(user_id)
             
-            # Update only live_user_state field
-            doc_ref.update({
-                "live_user_state": live_state.model_dump(),
-                "updated_at": firestore.SERVER_TIMESTAMP
-            })
+            state_dict = live_state.model_dump(mode="json")
+            if previous_state is None:
+                # Update only live_user_state field
+                updates = {"live_user_state": state_dict}
+            else:
+                # Capped lists are rewritten whole: ArrayUnion cannot drop the
+                # oldest entry, so it could push a list past LiveUserState's
+                # 5-item limit and make the persona fail to load
+                updates = {}
+                for field, value in state_dict.items():
+                    old_value = previous_state.get(field)
+                    if old_value == value:
+                        continue
+                    if field in _LIVE_STATE_COUNTERS and isinstance(old_value, int):
+                        value = firestore.Increment(value - old_value)
+                    updates[f"live_user_state.{field}"] = value
+            updates["updated_at"] = firestore.SERVER_TIMESTAMP
+            
+            doc_ref.update(updates)
+            
+            cached = self._get_cached_persona(user_id)
+            if cached is not None:
+                cached.live_user_state = live_state
+                self._cache_persona(cached)
             
             print(f"✅ Updated live state for user {user_id}")
             return True
             
         except Exception as e:
+            # The write may still have landed; make the next read go to Firestore
+            self.invalidate_persona_cache(user_id)
             print(f"❌ Error updating live state for user {user_id}: {e}")
             return False
     
@@ -218,6 +307,21 @@ class FirebaseService:
             print(f"❌ Error checking persona existence for user {user_id}: {e}")
             return False
     
+    def warmup(self) -> bool:
+        """
+        Open the Firestore gRPC channel with one tiny read, so the first
+        real request does not pay for DNS, TLS and channel setup.
+        
+        Returns:
+            bool: True if the read succeeded, False otherwise
+        """
+        try:
+            list(self.db.collection("user_persona").limit(1).stream())
+            return True
+        except Exception as e:
+            print(f"⚠️ Firestore warmup failed: {e}")
+            return False
+    
     # ========================================================================
     # USER COLLECTION OPERATIONS (for quiz data reference)
     # ========================================================================
@@ -679,7 +783,8 @@ class FirebaseService:
                 .document(user_id)
                 .collection('insights')
                 .order_by('timestamp', direction=firestore.Query.DESCENDING)
-                .limit(limit * 2)  # Fetch more if we need to filter
+                # Over-fetch only when some docs may be filtered out by type
+                .limit(limit * 2 if insight_types else limit)
             )
             
             docs = insights_ref.stream()
@@ -789,7 +894,7 @@ class FirebaseService:
             total_count = 0
             recent_count = 0  # Last 24 hours
             
-            now = datetime.utcnow()
+            now = datetime.now(timezone.utc)
             
             for persona in personas:
                 total_count += 1
@@ -800,6 +905,9 @@ class FirebaseService:
                 if generated_at_str:
                     try:
                         generated_at = datetime.fromisoformat(generated_at_str.replace('Z', '+00:00'))
+                        # Profiles stamped before generated_at carried an offset are naive UTC
+                        if generated_at.tzinfo is None:
+                            generated_at = generated_at.replace(tzinfo=timezone.utc)
                         hours_ago = (now - generated_at).total_seconds() / 3600
                         if hours_ago < 24:
                             recent_count += 1
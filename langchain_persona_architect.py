@@ -13,55 +13,61 @@ Architecture:
 - Supports dynamic state updates for real-time personalization
 """
 
-from typing import Dict, List, Optional, Any
-from datetime import datetime
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Literal, Optional, Any, Tuple, Union
+from datetime import datetime, timezone
 from enum import Enum
-from pydantic import BaseModel, Field
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-import json
+from functools import cached_property, lru_cache
+from collections import OrderedDict
+import asyncio
+import copy
+import hashlib
+import re
+import threading
+import time
+from types import MappingProxyType
+from pydantic import BaseModel, Field, field_validator, model_validator
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage
+from langchain_core.runnables import RunnableLambda
+from langchain_core.rate_limiters import InMemoryRateLimiter
+from langchain_core.utils.json import parse_partial_json
+import orjson
+
+if TYPE_CHECKING:
+    from langchain_google_genai import ChatGoogleGenerativeAI
 
 
 # ============================================================================
 # ENUMS - Personality Dimensions
 # ============================================================================
 
-class CommunicationStyle(str, Enum):
-    """How the user prefers to process and discuss emotions"""
-    LOGICAL = "logical"  # Prefers structured, analytical approaches
-    EMOTIONAL = "emotional"  # Prefers empathetic, feeling-based approaches
-    BALANCED = "balanced"  # Comfortable with both approaches
-
-
-class PrimaryStressor(str, Enum):
-    """Main source of stress for the user"""
-    ACADEMICS = "academics"  # Academic pressure, deadlines, performance
-    SOCIAL = "social"  # Social interactions, relationships, loneliness
-    SLEEP = "sleep"  # Sleep issues, fatigue, energy management
-    GENERAL = "general"  # General life stress, multiple factors
-
+# Profile dimensions are Literal types rather than Enums: the LLM output
+# schema gets inline `enum` lists instead of `$defs`/`$ref` indirection, and
+# pydantic-core validates them without Enum coercion.
 
-class SocialProfile(str, Enum):
-    """User's social energy and interaction preferences"""
-    INTROVERTED = "introverted"  # Drained by social interaction
-    EXTROVERTED = "extroverted"  # Energized by social interaction
-    AMBIVERTED = "ambiverted"  # Context-dependent social energy
+# How the user prefers to process and discuss emotions:
+# logical (structured, analytical), emotional (empathetic, feeling-based),
+# balanced (comfortable with both)
+CommunicationStyle = Literal["logical", "emotional", "balanced"]
 
+# Main source of stress for the user:
+# academics (pressure, deadlines, performance), social (relationships,
+# loneliness), sleep (fatigue, energy management), general (multiple factors)
+PrimaryStressor = Literal["academics", "social", "sleep", "general"]
 
-class CopingMechanism(str, Enum):
-    """How the user naturally copes with stress"""
-    ANALYTICAL = "analytical"  # Problem-solving, planning, logic
-    AFFECTIVE = "affective"  # Emotional expression, talking, connection
-    MIXED = "mixed"  # Uses both analytical and affective strategies
+# User's social energy and interaction preferences:
+# introverted (drained by social interaction), extroverted (energized by it),
+# ambiverted (context-dependent)
+SocialProfile = Literal["introverted", "extroverted", "ambiverted"]
 
+# How the user naturally copes with stress:
+# analytical (problem-solving, planning), affective (emotional expression,
+# connection), mixed (both)
+CopingMechanism = Literal["analytical", "affective", "mixed"]
 
-class StressLevel(str, Enum):
-    """Current overall stress assessment"""
-    LOW = "low"  # Manageable stress, good coping
-    MODERATE = "moderate"  # Some challenges, occasional overwhelm
-    HIGH = "high"  # Significant stress, needs immediate support
+# Current overall stress assessment:
+# low (manageable, good coping), moderate (occasional overwhelm),
+# high (significant stress, needs immediate support)
+StressLevel = Literal["low", "moderate", "high"]
 
 
 class Mood(str, Enum):
@@ -79,6 +85,10 @@ class Mood(str, Enum):
 # PYDANTIC MODELS - Data Structures
 # ============================================================================
 
+# Hard ceiling for the generated chatbot_system_prompt. The prompt asks for
+# <= 250 words (~1500 chars); the slack avoids clipping compliant output.
+_MAX_SYSTEM_PROMPT_CHARS = 2000
+
 class PersonalityProfile(BaseModel):
     """Static personality profile derived from quiz responses"""
     
@@ -129,17 +139,37 @@ class PersonalityProfile(BaseModel):
     
     # System prompt for AI chatbot
     chatbot_system_prompt: str = Field(
-        description="Complete system prompt for AI companion personalization. MUST explicitly state that Serebot is a wellness companion and NOT a therapist, psychologist, or medical provider. MUST include a direction to recommend professional help for crises."
+        description="Concise system prompt (at most 250 words) for AI companion personalization. MUST explicitly state that Serebot is a wellness companion and NOT a therapist, psychologist, or medical provider. MUST include a direction to recommend professional help for crises."
     )
     
     # Metadata
     generated_at: str = Field(
-        description="ISO timestamp of when profile was generated"
+        default_factory=lambda: datetime.now(timezone.utc).isoformat(),
+        description="ISO timestamp of when profile was generated (stamped server-side)"
     )
     quiz_version: str = Field(
         default="1.0",
         description="Version of quiz used for generation"
     )
+    
+    @field_validator("chatbot_system_prompt")
+    @classmethod
+    def _trim_system_prompt(cls, value: str) -> str:
+        """Trim runaway prompts at a word boundary instead of rejecting the profile"""
+        if len(value) <= _MAX_SYSTEM_PROMPT_CHARS:
+            return value
+        return value[:_MAX_SYSTEM_PROMPT_CHARS].rsplit(None, 1)[0]
+    
+    @cached_property
+    def chat_context(self) -> str:
+        """Static half of the chat persona context (profile never changes after generation)"""
+        return (
+            f"style={self.communication_style}, "
+            f"stressor={self.primary_stressor}, "
+            f"social={self.social_profile}, "
+            f"coping={self.coping_mechanism}, "
+            f"level={self.stress_level}"
+        )
 
 
 class LiveUserState(BaseModel):
@@ -155,7 +185,6 @@ class LiveUserState(BaseModel):
         description="Last type of interaction (onboarding, chat, tool_use, sleep_log, etc.)"
     )
     last_interaction_timestamp: str = Field(
-        default_factory=lambda: datetime.utcnow().isoformat(),
         description="ISO timestamp of last interaction"
     )
     
@@ -189,11 +218,34 @@ class LiveUserState(BaseModel):
         description="Flag indicating user might need proactive support"
     )
     
+    # Long-term conversation memory
+    conversation_summary: str = Field(
+        default="",
+        description="Rolling summary of chat turns older than the recent-history window"
+    )
+    summarized_through: str = Field(
+        default="",
+        description="created_at (loaded as 'timestamp') of the newest chat message folded into conversation_summary"
+    )
+    
     # Update metadata
     last_updated: str = Field(
-        default_factory=lambda: datetime.utcnow().isoformat(),
         description="ISO timestamp of last state update"
     )
+    
+    @model_validator(mode="before")
+    @classmethod
+    def _default_timestamps(cls, data: Any) -> Any:
+        """Fill missing timestamps (new states, older documents) from a single clock read"""
+        if isinstance(data, dict) and ("last_interaction_timestamp" not in data or "last_updated" not in data):
+            now = datetime.now(timezone.utc).isoformat()
+            data = {"last_interaction_timestamp": now, "last_updated": now, **data}
+        return data
+    
+    @classmethod
+    def fresh(cls, **fields: Any) -> "LiveUserState":
+        """New state with both timestamps set from a single clock read"""
+        return cls(**fields)
 
 
 class UserPersona(BaseModel):
@@ -210,6 +262,14 @@ class UserPersona(BaseModel):
     )
 
 
+class PersonalityProfileBatch(BaseModel):
+    """Personality profiles for several users generated in a single LLM call"""
+    
+    profiles: List[PersonalityProfile] = Field(
+        description="One personality profile per quiz, in the same order as the quizzes"
+    )
+
+
 class ChatResponse(BaseModel):
     """Unified chat response with tool recommendations in single JSON structure"""
     
@@ -244,47 +304,10 @@ class ChatResponse(BaseModel):
 
 
 # ============================================================================
-# LANGCHAIN PERSONA ARCHITECT
+# PROMPTS - Quiz analysis
 # ============================================================================
 
-class LangChainPersonaArchitect:
-    """
-    LangChain-based persona architect using Google Gemini 2.0 Flash
-    for intelligent quiz analysis and persona generation.
-    """
-    
-    def __init__(
-        self,
-        google_api_key: str,
-        model_name: str = "gemini-2.5-flash",
-        temperature: float = 0.5
-    ):
-        """
-        Initialize LangChain persona architect with Gemini.
-        
-        Args:
-            google_api_key: Google API key for Gemini
-            model_name: Gemini model to use (default: gemini-2.5-flash)
-            temperature: Model temperature (0.0-1.0)
-        """
-        self.llm = ChatGoogleGenerativeAI(
-            model=model_name,
-            temperature=temperature,
-            google_api_key=google_api_key,
-            #convert_system_message_to_human=True
-            top_p=0.8,
-            top_k=40
-        )
-        
-        # Set up output parser for PersonalityProfile (quiz generation)
-        self.parser = JsonOutputParser(pydantic_object=PersonalityProfile)
-        
-        # Set up output parser for ChatResponse (unified chat + tools)
-        self.chat_parser = JsonOutputParser(pydantic_object=ChatResponse)
-        
-        # Define the analysis prompt template
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a compassionate wellness assessment specialist helping to create personalised emotional well-being support for college students. You are NOT a licensed mental health professional, therapist, or medical provider, and must never describe yourself or the chatbot as one.
+_ANALYSIS_SYSTEM_PROMPT = """You are a compassionate wellness assessment specialist helping to create personalised emotional well-being support for college students. You are NOT a licensed mental health professional, therapist, or medical provider, and must never describe yourself or the chatbot as one.
 
 Serebot is a peer-support wellness companion (NOT a clinical tool or therapy service) serving college students dealing with stress, anxiety, sleep issues, and academic pressure. Your analysis must be:
 1. Evidence-informed and wellness-focused — not diagnostic or prescriptive
@@ -302,480 +325,1300 @@ Q6: "How much does sleep affect your mood and stress levels?"
 Q7: "When something goes wrong, what's your first response?"
 Q8: "How often do you find yourself distracted by your phone or social media?"
 Q9: "When you're feeling lonely, what's your go-to move?"
-Q10: "How often do you catch yourself thinking negative thoughts about yourself?"
-
-{format_instructions}"""),
-            ("user", """Analyze these quiz responses and generate a comprehensive personality profile:
+Q10: "How often do you catch yourself thinking negative thoughts about yourself?\""""
 
-{quiz_responses}
-
-Generate a complete PersonalityProfile with:
-1. Core personality dimensions (communication_style, primary_stressor, social_profile, coping_mechanism, stress_level)
+_PROFILE_REQUIREMENTS = """1. Core personality dimensions (communication_style, primary_stressor, social_profile, coping_mechanism, stress_level)
 2. Detailed insights (strengths, vulnerabilities, recommended_approach)
 3. Chatbot configuration (tone, methodology, proactive_triggers)
 4. Complete chatbot_system_prompt that will guide the AI's behavior
 
-The system prompt should be comprehensive (300-500 words) and include:
+Field notes:
+- recommended_approach and chatbot_methodology: wellness support styles inspired by evidence-based frameworks (e.g. mindfulness-based coping, cognitive reframing, strengths-based encouragement); never imply clinical treatment
+- chatbot_tone: e.g. "warm and empathetic" or "structured and logical"
+- proactive_triggers: situations where the chatbot should proactively reach out
+
+The system prompt MUST be concise (at most 250 words) and include:
 - Core identity: Serebot is a compassionate wellness companion — NOT a therapist, psychologist, or medical provider. It must never claim or imply clinical authority.
 - Tone and communication style suited to this user
 - Evidence-informed wellness support style (not clinical treatment)
 - Personalised guidance based on this user's quiz responses
 - When to gently check in vs. when to give space
-- Safety: if the user mentions crisis, self-harm, or severe distress, immediately encourage them to contact a professional and provide helplines (AASRA: +91-9820466726, iCall: +91-9152987821)""")
-        ])
-        
-        # Create the analysis chain
-        self.chain = (
-            {"quiz_responses": RunnablePassthrough(), "format_instructions": lambda _: self.parser.get_format_instructions()}
-            | self.prompt
-            | self.llm
-            | self.parser
-        )
-    
-    def generate_persona(
-        self,
-        user_id: str,
-        quiz_data: Dict[int, str]
-    ) -> UserPersona:
-        """
-        Generate complete user persona from quiz responses.
-        
-        Args:
-            user_id: Unique user ID from Firebase Auth
-            quiz_data: Dictionary mapping question IDs to selected answers
-                      e.g., {1: "a", 2: "c", 3: "b", ...}
-        
-        Returns:
-            UserPersona with personality_profile and live_user_state
-        """
-        # Format quiz responses for LLM analysis
-        quiz_text = self._format_quiz_for_analysis(quiz_data)
-        
-        # Run LangChain analysis
-        personality_profile_dict = self.chain.invoke(quiz_text)
-        
-        # Add generation timestamp
-        personality_profile_dict["generated_at"] = datetime.utcnow().isoformat()
-        
-        # Create PersonalityProfile from LLM output
-        personality_profile = PersonalityProfile(**personality_profile_dict)
-        
-        # Create initial LiveUserState
-        live_user_state = LiveUserState(
-            current_mood=Mood.NEUTRAL,
-            last_interaction="onboarding",
-            last_interaction_timestamp=datetime.utcnow().isoformat()
-        )
-        
-        # Combine into UserPersona
-        persona = UserPersona(
-            user_id=user_id,
-            personality_profile=personality_profile,
-            live_user_state=live_user_state
-        )
-        
-        return persona
+- Safety: if the user mentions crisis, self-harm, or severe distress, immediately encourage them to contact a professional and provide helplines (AASRA: +91-9820466726, iCall: +91-9152987821)"""
+
+# Everything static lives in one pre-built system message shared by the
+# single and batch prompts; only the quiz text follows it. A byte-identical
+# prefix lets Gemini's implicit context caching bill repeat calls at the
+# cached-token rate. It is built once here and never re-rendered.
+_ANALYSIS_SYSTEM_MESSAGE = SystemMessage(
+    content=_ANALYSIS_SYSTEM_PROMPT
+    + "\n\nEvery PersonalityProfile you generate must contain:\n"
+    + _PROFILE_REQUIREMENTS
+)
+
+
+def _analysis_messages(quiz_text: str) -> List[BaseMessage]:
+    """Messages for one user's quiz analysis (no prompt-template rendering)"""
+    return [
+        _ANALYSIS_SYSTEM_MESSAGE,
+        HumanMessage(content=(
+            "Analyze these quiz responses and generate a comprehensive personality profile:\n\n"
+            + quiz_text
+        )),
+    ]
+
+
+def _batch_analysis_messages(inputs: Dict[str, Any]) -> List[BaseMessage]:
+    """Messages for analyzing several users' quizzes in a single LLM call"""
+    n = inputs["n"]
+    return [
+        _ANALYSIS_SYSTEM_MESSAGE,
+        HumanMessage(content=(
+            f"Analyze each of the following {n} users' quiz responses independently:\n\n"
+            f"{inputs['quizzes']}\n\n"
+            f'Return exactly {n} complete profiles in the "profiles" array, '
+            "in the same order as the quizzes above."
+        )),
+    ]
+
+# Question and answer text used to render quiz responses for the LLM
+_QUIZ_QUESTIONS = MappingProxyType({
+    1: "When you're stressed, how do you prefer to work through it?",
+    2: "When you see posts about others' achievements on social media, how do you usually feel?",
+    3: "After a long social event, what do you usually want to do?",
+    4: "When you have a big deadline coming up, how do you usually feel?",
+    5: "How do you feel about reaching out for help when you're struggling?",
+    6: "How much does sleep affect your mood and stress levels?",
+    7: "When something goes wrong, what's your first response?",
+    8: "How often do you find yourself distracted by your phone or social media?",
+    9: "When you're feeling lonely, what's your go-to move?",
+    10: "How often do you catch yourself thinking negative thoughts about yourself?"
+})
+
+# Answer text for reference (simplified - you can expand this)
+_QUIZ_ANSWER_INTERPRETATIONS = MappingProxyType({
+    (1, "a"): "Talk it out with someone",
+    (1, "b"): "Make a plan and break it down logically",
+    (1, "c"): "Take space and process alone",
+    (1, "d"): "Distract myself with activities",
+    (2, "a"): "Inspired and motivated",
+    (2, "b"): "Behind or inadequate",
+    (2, "c"): "Neutral, it's just social media",
+    (2, "d"): "Happy for them, but sometimes envious",
+    (3, "a"): "Recharge alone with quiet time",
+    (3, "b"): "Process the event with someone",
+    (3, "c"): "Plan the next social activity",
+    (3, "d"): "Keep the energy going with more activities",
+    (4, "a"): "Energized and focused",
+    (4, "b"): "Anxious and overwhelmed",
+    (4, "c"): "Calm, I pace myself well",
+    (4, "d"): "Procrastinate until the last minute",
+    (5, "a"): "Comfortable, I reach out easily",
+    (5, "b"): "Uncomfortable, I prefer to handle things myself",
+    (5, "c"): "It depends on the situation",
+    (5, "d"): "I want to reach out but struggle to do so",
+    (6, "a"): "Huge impact, sleep is critical",
+    (6, "b"): "Moderate impact, noticeable but manageable",
+    (6, "c"): "Small impact, I adapt easily",
+    (6, "d"): "Minimal impact, rarely connected",
+    (7, "a"): "Analyze what happened and why",
+    (7, "b"): "Feel the emotions first, then problem-solve",
+    (7, "c"): "Seek advice from others",
+    (7, "d"): "Try to move on quickly",
+    (8, "a"): "Very often, it's a constant distraction",
+    (8, "b"): "Sometimes, when stressed or bored",
+    (8, "c"): "Rarely, I'm pretty focused",
+    (8, "d"): "Almost never, I stay present",
+    (9, "a"): "Reach out to someone",
+    (9, "b"): "Scroll through social media",
+    (9, "c"): "Engage in a solo hobby",
+    (9, "d"): "Just sit with the feeling",
+    (10, "a"): "Very often, it's a daily struggle",
+    (10, "b"): "Sometimes, especially during stress",
+    (10, "c"): "Rarely, I'm generally positive",
+    (10, "d"): "Almost never, I'm kind to myself"
+})
+
+# Fully rendered "question + answer" block for every known choice, so formatting
+# a quiz is one lookup per answer
+_QUIZ_ANSWER_LINES = MappingProxyType({
+    (q_id, answer): f"Q{q_id}: {_QUIZ_QUESTIONS[q_id]}\nAnswer: {text}\n\n"
+    for (q_id, answer), text in _QUIZ_ANSWER_INTERPRETATIONS.items()
+})
+
+# Upper bound on quizzes packed into one batch call; larger batches are split
+# (profile quality degrades when too many users share one response)
+MAX_PERSONA_BATCH_SIZE = 16
+
+# Bump whenever the analysis prompt or PersonalityProfile schema changes so
+# previously cached profiles are no longer served
+PROMPT_VERSION = "5"
+
+# Metadata the server stamps after validation; the model never generates them
+_SERVER_STAMPED_FIELDS = frozenset({"generated_at", "quiz_version"})
+
+
+def _schema_for_llm(schema: Any) -> Any:
+    """
+    Copy of a JSON schema trimmed to what the LLM must actually produce.
     
-    def _format_quiz_for_analysis(self, quiz_data: Dict[int, str]) -> str:
-        """Format quiz responses into readable text for LLM analysis"""
-        
-        # Question text for reference
-        questions = {
-            1: "When you're stressed, how do you prefer to work through it?",
-            2: "When you see posts about others' achievements on social media, how do you usually feel?",
-            3: "After a long social event, what do you usually want to do?",
-            4: "When you have a big deadline coming up, how do you usually feel?",
-            5: "How do you feel about reaching out for help when you're struggling?",
-            6: "How much does sleep affect your mood and stress levels?",
-            7: "When something goes wrong, what's your first response?",
-            8: "How often do you find yourself distracted by your phone or social media?",
-            9: "When you're feeling lonely, what's your go-to move?",
-            10: "How often do you catch yourself thinking negative thoughts about yourself?"
-        }
-        
-        # Answer text for reference (simplified - you can expand this)
-        answer_interpretations = {
-            (1, "a"): "Talk it out with someone",
-            (1, "b"): "Make a plan and break it down logically",
-            (1, "c"): "Take space and process alone",
-            (1, "d"): "Distract myself with activities",
-            (2, "a"): "Inspired and motivated",
-            (2, "b"): "Behind or inadequate",
-            (2, "c"): "Neutral, it's just social media",
-            (2, "d"): "Happy for them, but sometimes envious",
-            (3, "a"): "Recharge alone with quiet time",
-            (3, "b"): "Process the event with someone",
-            (3, "c"): "Plan the next social activity",
-            (3, "d"): "Keep the energy going with more activities",
-            (4, "a"): "Energized and focused",
-            (4, "b"): "Anxious and overwhelmed",
-            (4, "c"): "Calm, I pace myself well",
-            (4, "d"): "Procrastinate until the last minute",
-            (5, "a"): "Comfortable, I reach out easily",
-            (5, "b"): "Uncomfortable, I prefer to handle things myself",
-            (5, "c"): "It depends on the situation",
-            (5, "d"): "I want to reach out but struggle to do so",
-            (6, "a"): "Huge impact, sleep is critical",
-            (6, "b"): "Moderate impact, noticeable but manageable",
-            (6, "c"): "Small impact, I adapt easily",
-            (6, "d"): "Minimal impact, rarely connected",
-            (7, "a"): "Analyze what happened and why",
-            (7, "b"): "Feel the emotions first, then problem-solve",
-            (7, "c"): "Seek advice from others",
-            (7, "d"): "Try to move on quickly",
-            (8, "a"): "Very often, it's a constant distraction",
-            (8, "b"): "Sometimes, when stressed or bored",
-            (8, "c"): "Rarely, I'm pretty focused",
-            (8, "d"): "Almost never, I stay present",
-            (9, "a"): "Reach out to someone",
-            (9, "b"): "Scroll through social media",
-            (9, "c"): "Engage in a solo hobby",
-            (9, "d"): "Just sit with the feeling",
-            (10, "a"): "Very often, it's a daily struggle",
-            (10, "b"): "Sometimes, especially during stress",
-            (10, "c"): "Rarely, I'm generally positive",
-            (10, "d"): "Almost never, I'm kind to myself"
+    Drops `description` strings (the LLM gets the few it needs as "Field
+    notes" in the prompt) and server-stamped metadata properties, which keeps
+    both the schema sent with every call and the generated output small.
+    """
+    if isinstance(schema, dict):
+        trimmed = {
+            key: _schema_for_llm(value)
+            for key, value in schema.items()
+            if not (key == "description" and isinstance(value, str))
         }
-        
-        formatted = "User Quiz Responses:\n\n"
-        for q_id, answer in sorted(quiz_data.items()):
-            question_text = questions.get(q_id, f"Question {q_id}")
-            answer_text = answer_interpretations.get((q_id, answer), f"Answer {answer}")
-            formatted += f"Q{q_id}: {question_text}\nAnswer: {answer_text}\n\n"
-        
-        return formatted
-    
-    def update_user_state(
-        self,
-        current_state: LiveUserState,
-        action: Dict[str, Any]
-    ) -> LiveUserState:
-        """
-        Update live user state based on wellness tool actions.
-        
-        Supported action types:
-        - chat_message: General chat interaction
-        - tool_use: Generic tool usage
-        - sleep_log: Sleep tracking
-        - breathing_exercise: From breathing_service (4-7-8, Diaphragmatic, Box, etc.)
-        - grounding_technique: From grounding_service (5-4-3-2-1, Body Scan, etc.)
-        - mindfulness_meditation: From mindfulness_service (Body Scan, Mindful Walking, Mindful Eating)
-        - body_relaxation: From body_relaxation_service (Body Mapping, Wave Breathing, Self-Hug)
-        
-        Args:
-            current_state: Current LiveUserState
-            action: Dictionary with "type" and "content" (exercise data from Firebase)
-        
-        Returns:
-            Updated LiveUserState
-        """
-        action_type = action.get("type", "unknown").lower()
-        content = action.get("content", {})
-        
-        # Update based on action type
-        if action_type == "chat_message":
-            current_state.chat_message_count += 1
-            current_state.last_interaction = "chat"
-            
-            # Update mood if provided
-            if "mood" in action:
-                try:
-                    current_state.current_mood = Mood(action["mood"])
-                except ValueError:
-                    pass  # Invalid mood, keep current
-            
-            # Extract recent stressors from content
-            if "content" in action and "stress" in action["content"].lower():
-                stressor = action.get("stressor_detected", "general stress")
-                if stressor not in current_state.recent_stressors:
-                    current_state.recent_stressors.append(stressor)
-                    if len(current_state.recent_stressors) > 5:
-                        current_state.recent_stressors.pop(0)
-        
-        elif action_type == "tool_use":
-            current_state.tool_usage_count += 1
-            current_state.last_interaction = "tool_use"
-            
-            # Track successful coping strategies
-            tool_name = action.get("tool_name", "unknown tool")
-            success = f"Used {tool_name}"
-            if success not in current_state.coping_successes:
-                current_state.coping_successes.append(success)
-                if len(current_state.coping_successes) > 5:
-                    current_state.coping_successes.pop(0)
-        
-        elif action_type == "sleep_log":
-            current_state.sleep_logs_count += 1
-            current_state.last_interaction = "sleep_log"
-            
-            # Check if poor sleep indicates need for check-in
-            hours = action.get("hours", 7)
-            quality = action.get("quality", "good")
-            if hours < 5 or quality in ["poor", "very poor"]:
-                current_state.needs_check_in = True
-        
-        # ====================================================================
-        # BREATHING EXERCISES (breathing_service.dart)
-        # ====================================================================
-        elif action_type == "breathing_exercise":
-            current_state.tool_usage_count += 1
-            current_state.last_interaction = "breathing_exercise"
-            
-            # Update mood from afterMood
-            after_mood = content.get("afterMood", "").lower()
-            if after_mood:
-                try:
-                    current_state.current_mood = Mood(after_mood)
-                except ValueError:
-                    pass
-            
-            # Track technique as coping success
-            technique = content.get("technique", "Breathing Exercise")
-            mood_improvement = content.get("moodImprovement", "")
-            
-            if mood_improvement == "Improved":
-                success = f"{technique} - Improved mood"
-                if success not in current_state.coping_successes:
-                    current_state.coping_successes.append(success)
-                    if len(current_state.coping_successes) > 5:
-                        current_state.coping_successes.pop(0)
-                current_state.needs_check_in = False
-            
-            # Check if user struggled (needs support)
-            session_quality = content.get("sessionQuality", "")
-            completed = content.get("completed", False)
-            paused_times = content.get("pausedTimes", 0)
-            
-            if session_quality == "Needs Improvement" or (not completed and paused_times > 3):
-                current_state.needs_check_in = True
-                # Track difficulty as potential stressor
-                stressor = f"Difficulty with {technique}"
-                if stressor not in current_state.recent_stressors:
-                    current_state.recent_stressors.append(stressor)
-                    if len(current_state.recent_stressors) > 5:
-                        current_state.recent_stressors.pop(0)
-        
-        # ====================================================================
-        # GROUNDING TECHNIQUES (grounding_service.dart)
-        # ====================================================================
-        elif action_type == "grounding_technique":
-            current_state.tool_usage_count += 1
-            current_state.last_interaction = "grounding_technique"
-            
-            # Update mood
-            after_mood = content.get("afterMood", "").lower()
-            if after_mood:
-                try:
-                    current_state.current_mood = Mood(after_mood)
-                except ValueError:
-                    pass
-            
-            # Track technique
-            technique_used = content.get("techniqueUsed", "Grounding Technique")
-            mood_improvement = content.get("moodImprovement", "")
-            
-            if mood_improvement == "Improved":
-                success = f"{technique_used} - Helped with grounding"
-                if success not in current_state.coping_successes:
-                    current_state.coping_successes.append(success)
-                    if len(current_state.coping_successes) > 5:
-                        current_state.coping_successes.pop(0)
-                current_state.needs_check_in = False
-            
-            # Check stress levels and environment
-            stress_level = content.get("currentStressLevel", "")
-            if stress_level in ["High", "Very High"]:
-                current_state.needs_check_in = True
-                environment = content.get("environmentType", "general situation")
-                stressor = f"High stress in {environment}"
-                if stressor not in current_state.recent_stressors:
-                    current_state.recent_stressors.append(stressor)
-                    if len(current_state.recent_stressors) > 5:
-                        current_state.recent_stressors.pop(0)
-        
-        # ====================================================================
-        # MINDFULNESS MEDITATION (mindfulness_service.dart)
-        # ====================================================================
-        elif action_type == "mindfulness_meditation":
-            current_state.tool_usage_count += 1
-            current_state.last_interaction = "mindfulness_meditation"
-            
-            # Update mood
-            after_mood = content.get("moodAfter", "").lower()
-            if after_mood:
-                try:
-                    current_state.current_mood = Mood(after_mood)
-                except ValueError:
-                    pass
-            
-            # Track technique
-            technique_used = content.get("techniqueUsed", "Meditation")
-            mood_improvement = content.get("moodImprovement", "")
-            session_quality = content.get("sessionQuality", "")
-            
-            if mood_improvement == "Improved" or session_quality == "Excellent":
-                success = f"{technique_used} meditation"
-                if success not in current_state.coping_successes:
-                    current_state.coping_successes.append(success)
-                    if len(current_state.coping_successes) > 5:
-                        current_state.coping_successes.pop(0)
-                current_state.needs_check_in = False
-            
-            # Check for struggles
-            completed = content.get("completed", False)
-            pause_count = content.get("pauseCount", 0)
-            completion_rate = float(content.get("completionRate", 100))
-            
-            if not completed and pause_count > 2 and completion_rate < 50:
-                current_state.needs_check_in = True
-                stressor = f"Difficulty maintaining focus during {technique_used}"
-                if stressor not in current_state.recent_stressors:
-                    current_state.recent_stressors.append(stressor)
-                    if len(current_state.recent_stressors) > 5:
-                        current_state.recent_stressors.pop(0)
-        
-        # ====================================================================
-        # BODY RELAXATION (body_relaxation_service.dart)
-        # ====================================================================
-        elif action_type == "body_relaxation":
-            current_state.tool_usage_count += 1
-            current_state.last_interaction = "body_relaxation"
-            
-            # Update mood
-            after_mood = content.get("moodAfter", "").lower()
-            if after_mood:
-                try:
-                    current_state.current_mood = Mood(after_mood)
-                except ValueError:
-                    pass
-            
-            # Track tool
-            tool_used = content.get("toolUsed", "Body Relaxation")
-            mood_improvement = content.get("moodImprovement", "")
-            session_quality = content.get("sessionQuality", "")
-            
-            if mood_improvement == "Improved" or session_quality == "Excellent":
-                success = f"{tool_used}"
-                if success not in current_state.coping_successes:
-                    current_state.coping_successes.append(success)
-                    if len(current_state.coping_successes) > 5:
-                        current_state.coping_successes.pop(0)
-                current_state.needs_check_in = False
-            
-            # Check for body tension issues (Body Mapping specific)
-            if tool_used == "Body Mapping":
-                has_very_tense = content.get("hasVeryTenseTensionAreas", False)
-                if has_very_tense:
-                    stressor = "Significant body tension detected"
-                    if stressor not in current_state.recent_stressors:
-                        current_state.recent_stressors.append(stressor)
-                        if len(current_state.recent_stressors) > 5:
-                            current_state.recent_stressors.pop(0)
-        
-        # Update timestamp
-        current_state.last_interaction_timestamp = datetime.utcnow().isoformat()
-        current_state.last_updated = datetime.utcnow().isoformat()
-        
-        return current_state
-    
-    def _analyze_user_sentiment(
-        self,
-        state: LiveUserState,
-        key_insights: Optional[List[Dict[str, Any]]] = None
-    ) -> str:
-        """
-        Analyze user's current sentiment and generate adaptive communication guidance.
-        
-        Args:
-            state: Current LiveUserState
-            key_insights: Recent key moments
-            
-        Returns:
-            Sentiment-specific communication guidance
-        """
-        mood = state.current_mood.value
-        needs_support = state.needs_check_in
-        has_stressors = len(state.recent_stressors) > 0
-        has_successes = len(state.coping_successes) > 0
-        
-        # Analyze recent insights for crisis indicators
-        crisis_indicators = False
-        if key_insights:
-            for insight in key_insights:
-                if insight.get('type') in ['crisis', 'severe_stress', 'self_harm']:
-                    crisis_indicators = True
-                    break
-        
-        # Generate adaptive guidance based on sentiment
-        if crisis_indicators or mood in ['sad', 'anxious'] and needs_support:
-            return """**CURRENT SENTIMENT: NEEDS GENTLE SUPPORT**
+        if isinstance(trimmed.get("properties"), dict):
+            trimmed["properties"] = {
+                name: prop for name, prop in trimmed["properties"].items()
+                if name not in _SERVER_STAMPED_FIELDS
+            }
+            if "required" in trimmed:
+                trimmed["required"] = [name for name in trimmed["required"] if name not in _SERVER_STAMPED_FIELDS]
+        return trimmed
+    if isinstance(schema, list):
+        return [_schema_for_llm(item) for item in schema]
+    return schema
+
+
+# ============================================================================
+# PROMPTS - Chat
+# ============================================================================
+
+# Static output contract appended to every chat system prompt; built once
+# at import rather than re-rendered on each turn
+_CHAT_OUTPUT_SPEC = """You MUST output ONLY a JSON object, and the "response" field MUST be written in clean, readable Markdown (formatted like a beautiful Markdown message). Do NOT add any text outside the JSON object:
+{
+  "response": "<empathetic reply: validate the user's feelings, offer gentle support and grounded wellness suggestions as a caring peer companion — never diagnose or claim clinical authority>",
+  "recommended_tools": {"<tool_key>": <score 0-100>, ...}
+}
+
+"recommended_tools" lists ONLY the tools scoring 10 or more, using the tool keys from the mapping below. Leave every other tool out; omitted tools count as 0.
+
+Tool scoring logic:
+- 90–100: explicitly suggested
+- 70–89: strong emotional match
+- 50–69: moderate relevance
+- 30–49: weak relevance
+- 10–29: minimal match
+- 0–9: not relevant (omit)
+
+Emotion→tool mapping:
+diaphragmatic_breathing=anxiety/overwhelm
+box_breathing=focus_loss/exam_stress
+four_seven_eight_breathing=insomnia/night_anxiety
+pursed_lip_breathing=panic_spike
+body_mapping=body_tension/heaviness
+wave_breathing=agitation
+self_hug=self_blame/lonely
+five_four_three_two_one=panic/dissociation/overstim
+texture_focus=public_anxiety/subtle_grounding
+mental_grounding=rumination/loops
+body_scan_meditation=fatigue/bedtime
+mindful_walking=stuck/restless
+mindful_eating=emotional_eating/appetite_issues"""
+
+# Identity, guidelines and output contract shared by every chat turn. It
+# opens the system prompt so consecutive turns (from any user) share a
+# byte-identical prefix that Gemini's implicit context caching can reuse.
+_CHAT_STATIC_PROMPT = """You are Serebot — a calm, soft, empathetic, gentle wellbeing companion created by Avni Singhal (LinkedIn: https://www.linkedin.com/in/avnisinghal001 | GitHub: https://github.com/avnisinghal001).
+
+Soothe first: create emotional safety and validation.
+Guide second: offer thoughtful, actionable, and realistic steps.
+offer 2–3 gentle, grounded steps.
+Empower third: encourage progress and autonomy, never dependency.
+
+Use persona + key insights only when they naturally fit the user's current emotional state.
+Respond briefly, softly, and with emotional clarity.
+No medical claims, no diagnosis, no fabricated facts; if unsure, say so honestly.
+If user expresses crisis, self-harm, or severe distress → respond with immediate compassion, validate their feelings without minimising, and urgently direct them to professional support: AASRA: +91-9820466726, iCall: +91-9152987821. Remind them that you are a wellness companion, not a crisis or clinical service.
+
+""" + _CHAT_OUTPUT_SPEC
+
+
+# Rolling conversation summary: older turns are folded in once at least
+# this many have dropped out of the recent-history window
+_SUMMARY_MIN_MESSAGES = 4
+_MAX_SUMMARY_CHARS = 1200
+
+_SUMMARY_SYSTEM_PROMPT = """You maintain a private memory of a user's conversations with Serebot, a wellbeing companion.
+Merge the new turns into the current summary. Keep what helps future conversations: ongoing struggles, important events, what helped or did not, goals and preferences.
+Drop small talk. Use the fewest and shortest words possible, at most 120 words, plain text, no preamble."""
+
+# Upper bound on prior turns sent with each chat message, so one long
+# vent cannot blow up per-request cost (the count cap lives in main.py)
+_CHAT_HISTORY_TOKEN_BUDGET = 3500
+
+# Marker main.py prepends to a resumed conversation; DOTALL keeps multi-line messages whole
+_FOLLOW_UP_RE = re.compile(r'\[FOLLOW_UP:(\d+)min\] (.*)', re.DOTALL)
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough Gemini token count (~4 characters per token), no tokenizer call"""
+    return len(text) // 4 + 1
+
+
+@lru_cache(maxsize=1024)
+def _chat_system_prefix(name: str, profile_context: str) -> str:
+    """Static chat prompt plus one user's name and profile (rendered once per user)"""
+    return f"""{_CHAT_STATIC_PROMPT}
+
+ALWAYS address the user by only their first name(strictly first name only before the first space) from (**{name}**) in every response to create a personal touch. The name is fetched using the get_user_full_name function for personalization.
+Context: {profile_context}
+"""
+
+
+# ============================================================================
+# PROMPTS - Sentiment guidance (static, selected per chat turn)
+# ============================================================================
+
+_SENTIMENT_SUPPORT = """**CURRENT SENTIMENT: NEEDS GENTLE SUPPORT**
 - They're struggling right now—be extra gentle and validating
 - Don't rush to fix or offer solutions immediately
 - Sit with them in the discomfort: "This sounds really hard..."
 - Listen more than you speak
 - If appropriate, gently suggest grounding tools (**5-4-3-2-1 Method**, **Wave Breathing**)
 - Avoid toxic positivity or minimizing their pain"""
-        
-        elif mood == 'anxious' or 'anxiety' in str(state.recent_stressors).lower():
-            return """**CURRENT SENTIMENT: ANXIOUS/OVERWHELMED**
+
+_SENTIMENT_ANXIOUS = """**CURRENT SENTIMENT: ANXIOUS/OVERWHELMED**
 - They need calm and grounding right now
 - Use slow, steady language—avoid rushing
 - Acknowledge the anxiety without amplifying it: "That sounds overwhelming..."
 - Offer grounding/breathing techniques naturally if they seem open
 - Focus on "one step at a time" mentality
 - **Box Breathing**, **5-4-3-2-1 Method**, or **Diaphragmatic Breathing** might help"""
-        
-        elif mood == 'stressed':
-            return """**CURRENT SENTIMENT: STRESSED**
+
+_SENTIMENT_STRESSED = """**CURRENT SENTIMENT: STRESSED**
 - They're under pressure—validate that stress is real
 - Be practical and supportive, not overly soft
 - It's okay to give honest perspective with care
 - Ask what's specifically stressing them out
 - Suggest active tools: **Box Breathing** (focus), **Body Mapping** (release tension)
 - Help them break things down if they're overwhelmed"""
-        
-        elif mood == 'tired' or 'sleep' in str(state.recent_stressors).lower():
-            return """**CURRENT SENTIMENT: EXHAUSTED**
+
+_SENTIMENT_EXHAUSTED = """**CURRENT SENTIMENT: EXHAUSTED**
 - They're drained—meet them with gentle energy
 - Validate exhaustion: "You sound so tired... that's okay"
 - Don't push active tools—offer rest-focused ones
 - **4-7-8 Breathing** (sleep), **Body Scan** (relaxation), **Wave Breathing** (gentle)
 - Sometimes just being heard is enough—don't over-advise"""
-        
-        elif mood in ['happy', 'motivated'] or has_successes:
-            return """**CURRENT SENTIMENT: POSITIVE MOMENTUM**
+
+_SENTIMENT_POSITIVE = """**CURRENT SENTIMENT: POSITIVE MOMENTUM**
 - They're doing well—celebrate genuinely!
 - Match their energy (but keep it natural, not fake-enthusiastic)
 - "That's wonderful! What's been helping?"
 - Reinforce what's working: reference their recent successes
 - Don't be overly cautious—they can handle real conversation right now
 - Build on momentum without pressuring"""
-        
-        elif mood == 'neutral' and not needs_support:
-            return """**CURRENT SENTIMENT: STABLE/NEUTRAL**
+
+_SENTIMENT_NEUTRAL = """**CURRENT SENTIMENT: STABLE/NEUTRAL**
 - They're in a good place to have real conversations
 - Be natural and authentic—no need to walk on eggshells
 - You can offer honest perspective with care
 - Good time to check in on goals or explore deeper topics
 - Balance support with gentle challenge if appropriate"""
-        
-        elif has_stressors and not has_successes:
-            return """**CURRENT SENTIMENT: STRUGGLING TO COPE**
+
+_SENTIMENT_STRUGGLING = """**CURRENT SENTIMENT: STRUGGLING TO COPE**
 - They're facing stressors without finding what works yet
 - Be patient and exploratory: "Let's figure this out together..."
 - Don't overwhelm with too many tool suggestions
 - Focus on understanding their experience first
 - Gently introduce one relevant tool at a time
 - Validate that finding what works takes time"""
-        
-        else:
-            return """**CURRENT SENTIMENT: GETTING TO KNOW THEM**
+
+_SENTIMENT_NEW_USER = """**CURRENT SENTIMENT: GETTING TO KNOW THEM**
 - Early in the relationship—build trust first
 - Be warm, genuine, and non-judgmental
 - Listen deeply and remember what they share
 - Don't rush to give advice—understand them first
 - Ask curious, caring questions
 - Let the relationship develop naturally"""
+
+_CRISIS_INSIGHT_TYPES = frozenset({'crisis', 'severe_stress', 'self_harm'})
+
+# (predicate, guidance) in priority order; a predicate receives
+# (state, mood value, lowercased stressors text, crisis flag).
+# Users matching none of them get _SENTIMENT_NEW_USER.
+_SENTIMENT_RULES = (
+    (lambda s, mood, stressors, crisis: crisis or (mood in ('sad', 'anxious') and s.needs_check_in),
+     _SENTIMENT_SUPPORT),
+    (lambda s, mood, stressors, crisis: mood == 'anxious' or 'anxiety' in stressors,
+     _SENTIMENT_ANXIOUS),
+    (lambda s, mood, stressors, crisis: mood == 'stressed',
+     _SENTIMENT_STRESSED),
+    (lambda s, mood, stressors, crisis: mood == 'tired' or 'sleep' in stressors,
+     _SENTIMENT_EXHAUSTED),
+    (lambda s, mood, stressors, crisis: mood in ('happy', 'motivated') or bool(s.coping_successes),
+     _SENTIMENT_POSITIVE),
+    (lambda s, mood, stressors, crisis: mood == 'neutral' and not s.needs_check_in,
+     _SENTIMENT_NEUTRAL),
+    (lambda s, mood, stressors, crisis: bool(s.recent_stressors) and not s.coping_successes,
+     _SENTIMENT_STRUGGLING),
+)
+
+
+# ============================================================================
+# LIVE STATE UPDATE HANDLERS - One per app action type
+# ============================================================================
+
+# Matches the max_length of LiveUserState's rolling lists
+_RECENT_ITEMS_LIMIT = 5
+
+
+def _push_unique(items: List[str], value: str, limit: int = _RECENT_ITEMS_LIMIT):
+    """Append `value` if new, dropping the oldest entries beyond `limit`"""
+    if value not in items:
+        items.append(value)
+        del items[:-limit]
+
+
+# Case-insensitive scan, so long messages are never copied just to lowercase them
+_STRESS_RE = re.compile("stress", re.IGNORECASE)
+
+
+def _apply_session_result(
+    state: LiveUserState,
+    interaction: str,
+    content: Dict[str, Any],
+    mood_key: str,
+    success: Optional[str]
+):
+    """Shared bookkeeping for a finished wellness-tool session"""
+    state.tool_usage_count += 1
+    state.last_interaction = interaction
+    
+    # Update mood from the session's after-mood field
+    after_mood = content.get(mood_key, "").lower()
+    if after_mood:
+        try:
+            state.current_mood = Mood(after_mood)
+        except ValueError:
+            pass
+    
+    # Track what helped as a coping success
+    if success:
+        _push_unique(state.coping_successes, success)
+        state.needs_check_in = False
+
+
+def _flag_struggle(state: LiveUserState, stressor: str):
+    """User struggled: ask for a check-in and remember why"""
+    state.needs_check_in = True
+    _push_unique(state.recent_stressors, stressor)
+
+
+def _handle_chat_message(state: LiveUserState, action: Dict[str, Any], content: Any):
+    state.chat_message_count += 1
+    state.last_interaction = "chat"
+    
+    # Update mood if provided
+    if "mood" in action:
+        try:
+            state.current_mood = Mood(action["mood"])
+        except ValueError:
+            pass  # Invalid mood, keep current
+    
+    # Extract recent stressors: a caller-classified stressor wins, otherwise
+    # fall back to scanning the message text
+    stressor = action.get("stressor_detected")
+    if stressor:
+        _push_unique(state.recent_stressors, stressor)
+    elif _STRESS_RE.search(action.get("content", "")):
+        _push_unique(state.recent_stressors, "general stress")
+
+
+def _handle_tool_use(state: LiveUserState, action: Dict[str, Any], content: Any):
+    state.tool_usage_count += 1
+    state.last_interaction = "tool_use"
+    
+    # Track successful coping strategies
+    _push_unique(state.coping_successes, f"Used {action.get('tool_name', 'unknown tool')}")
+
+
+def _handle_sleep_log(state: LiveUserState, action: Dict[str, Any], content: Any):
+    state.sleep_logs_count += 1
+    state.last_interaction = "sleep_log"
+    
+    # Check if poor sleep indicates need for check-in
+    hours = action.get("hours", 7)
+    quality = action.get("quality", "good")
+    if hours < 5 or quality in ["poor", "very poor"]:
+        state.needs_check_in = True
+
+
+def _handle_breathing_exercise(state: LiveUserState, action: Dict[str, Any], content: Dict[str, Any]):
+    """breathing_service.dart: 4-7-8, Diaphragmatic, Box, etc."""
+    technique = content.get("technique", "Breathing Exercise")
+    improved = content.get("moodImprovement", "") == "Improved"
+    _apply_session_result(
+        state, "breathing_exercise", content, "afterMood",
+        f"{technique} - Improved mood" if improved else None
+    )
+    
+    # Check if user struggled (needs support)
+    session_quality = content.get("sessionQuality", "")
+    completed = content.get("completed", False)
+    paused_times = content.get("pausedTimes", 0)
+    if session_quality == "Needs Improvement" or (not completed and paused_times > 3):
+        _flag_struggle(state, f"Difficulty with {technique}")
+
+
+def _handle_grounding_technique(state: LiveUserState, action: Dict[str, Any], content: Dict[str, Any]):
+    """grounding_service.dart: 5-4-3-2-1, Body Scan, etc."""
+    technique_used = content.get("techniqueUsed", "Grounding Technique")
+    improved = content.get("moodImprovement", "") == "Improved"
+    _apply_session_result(
+        state, "grounding_technique", content, "afterMood",
+        f"{technique_used} - Helped with grounding" if improved else None
+    )
+    
+    # Check stress levels and environment
+    if content.get("currentStressLevel", "") in ["High", "Very High"]:
+        environment = content.get("environmentType", "general situation")
+        _flag_struggle(state, f"High stress in {environment}")
+
+
+def _handle_mindfulness_meditation(state: LiveUserState, action: Dict[str, Any], content: Dict[str, Any]):
+    """mindfulness_service.dart: Body Scan, Mindful Walking, Mindful Eating"""
+    technique_used = content.get("techniqueUsed", "Meditation")
+    helped = content.get("moodImprovement", "") == "Improved" or content.get("sessionQuality", "") == "Excellent"
+    _apply_session_result(
+        state, "mindfulness_meditation", content, "moodAfter",
+        f"{technique_used} meditation" if helped else None
+    )
+    
+    # Check for struggles
+    completed = content.get("completed", False)
+    pause_count = content.get("pauseCount", 0)
+    completion_rate = float(content.get("completionRate", 100))
+    if not completed and pause_count > 2 and completion_rate < 50:
+        _flag_struggle(state, f"Difficulty maintaining focus during {technique_used}")
+
+
+def _handle_body_relaxation(state: LiveUserState, action: Dict[str, Any], content: Dict[str, Any]):
+    """body_relaxation_service.dart: Body Mapping, Wave Breathing, Self-Hug"""
+    tool_used = content.get("toolUsed", "Body Relaxation")
+    helped = content.get("moodImprovement", "") == "Improved" or content.get("sessionQuality", "") == "Excellent"
+    _apply_session_result(
+        state, "body_relaxation", content, "moodAfter",
+        tool_used if helped else None
+    )
+    
+    # Check for body tension issues (Body Mapping specific)
+    if tool_used == "Body Mapping" and content.get("hasVeryTenseTensionAreas", False):
+        _push_unique(state.recent_stressors, "Significant body tension detected")
+
+
+_STATE_HANDLERS = {
+    "chat_message": _handle_chat_message,
+    "tool_use": _handle_tool_use,
+    "sleep_log": _handle_sleep_log,
+    "breathing_exercise": _handle_breathing_exercise,
+    "grounding_technique": _handle_grounding_technique,
+    "mindfulness_meditation": _handle_mindfulness_meditation,
+    "body_relaxation": _handle_body_relaxation,
+}
+
+
+# Every wellness tool the app can recommend, all unscored (read-only;
+# callers get a fresh dict from _get_default_tools)
+_DEFAULT_TOOL_SCORES = MappingProxyType(dict.fromkeys((
+    "diaphragmatic_breathing",
+    "box_breathing",
+    "four_seven_eight_breathing",
+    "pursed_lip_breathing",
+    "body_mapping",
+    "wave_breathing",
+    "self_hug",
+    "five_four_three_two_one",
+    "texture_focus",
+    "mental_grounding",
+    "body_scan_meditation",
+    "mindful_walking",
+    "mindful_eating",
+), 0.0))
+
+# Decode-time contract for chat replies (Gemini constrained decoding).
+# "response" comes first so streamed replies start with the text; every
+# tool score is optional, matching the sparse "recommended_tools" spec
+_CHAT_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "response": {"type": "string"},
+        "recommended_tools": {
+            "type": "object",
+            "properties": {tool: {"type": "number"} for tool in _DEFAULT_TOOL_SCORES},
+        },
+    },
+    "required": ["response", "recommended_tools"],
+}
+
+# Keyword fallback for tool scores: phrase -> score per tool
+_TOOL_KEYWORD_SCORES = {
+    # Breathing exercises
+    "diaphragmatic_breathing": [
+        ("diaphragmatic breathing", 95.0),
+        ("belly breath", 85.0),
+        ("deep breath", 60.0),
+        ("breath deeply", 55.0)
+    ],
+    "box_breathing": [
+        ("box breathing", 95.0),
+        ("4-4-4-4", 90.0),
+        ("equal breath", 70.0)
+    ],
+    "four_seven_eight_breathing": [
+        ("4-7-8 breathing", 95.0),
+        ("four seven eight", 95.0),
+        ("sleep breath", 75.0)
+    ],
+    "pursed_lip_breathing": [
+        ("pursed lip", 95.0),
+        ("pursed-lip", 95.0),
+        ("slow exhale", 70.0),
+        ("gentle exhale", 65.0),
+        ("breathe out slowly", 60.0)
+    ],
+    # Body relaxation
+    "body_mapping": [
+        ("body mapping", 95.0),
+        ("body tension", 70.0),
+        ("where you feel", 60.0)
+    ],
+    "wave_breathing": [
+        ("wave breathing", 95.0),
+        ("wave breath", 90.0),
+        ("rhythmic breath", 65.0)
+    ],
+    "self_hug": [
+        ("self-hug", 95.0),
+        ("self hug", 95.0),
+        ("hug yourself", 85.0),
+        ("self-compassion", 60.0)
+    ],
+    # Grounding techniques
+    "five_four_three_two_one": [
+        ("5-4-3-2-1", 95.0),
+        ("five things", 80.0),
+        ("sensory grounding", 75.0),
+        ("what you see", 65.0),
+        ("notice around you", 55.0)
+    ],
+    "texture_focus": [
+        ("texture focus", 95.0),
+        ("feel the texture", 85.0),
+        ("texture", 70.0),
+        ("touch something", 60.0),
+        ("feeling something physical", 65.0)
+    ],
+    "mental_grounding": [
+        ("mental grounding", 95.0),
+        ("racing thoughts", 70.0),
+        ("slow your thoughts", 65.0)
+    ],
+    # Meditation
+    "body_scan_meditation": [
+        ("body scan", 95.0),
+        ("scan your body", 85.0),
+        ("progressive relaxation", 80.0)
+    ],
+    "mindful_walking": [
+        ("mindful walk", 95.0),
+        ("walking meditation", 90.0),
+        ("mindful step", 80.0)
+    ],
+    "mindful_eating": [
+        ("mindful eat", 95.0),
+        ("mindful meal", 85.0),
+        ("eating meditation", 80.0)
+    ]
+}
+
+def _index_tool_keywords() -> Dict[str, List[Tuple[str, float]]]:
+    """Invert _TOOL_KEYWORD_SCORES: phrase -> every (tool, score) it contributes"""
+    hits: Dict[str, List[Tuple[str, float]]] = {}
+    for tool_key, keywords in _TOOL_KEYWORD_SCORES.items():
+        for keyword, score in keywords:
+            hits.setdefault(keyword, []).append((tool_key, score))
+    return hits
+
+
+_TOOL_KEYWORD_HITS = _index_tool_keywords()
+
+
+def _check_keyword_prefixes():
+    """
+    The scan below reports only the longest phrase starting at each position,
+    so a phrase that is a prefix of another ("texture" / "texture focus") is
+    hidden wherever the longer one matches. That only leaves the scores
+    unchanged if the longer phrase scores every tool of the shorter one at
+    least as high; fail at import if a table edit breaks this.
+    """
+    for short in _TOOL_KEYWORD_HITS:
+        for long in _TOOL_KEYWORD_HITS:
+            if long == short or not long.startswith(short):
+                continue
+            long_scores = dict(_TOOL_KEYWORD_HITS[long])
+            for tool_key, score in _TOOL_KEYWORD_HITS[short]:
+                if long_scores.get(tool_key, -1.0) < score:
+                    raise ValueError(
+                        f"Keyword '{long}' would hide '{short}' ({tool_key}={score}) "
+                        "in the single-pass tool scan"
+                    )
+
+
+_check_keyword_prefixes()
+
+# One pass over the text: the lookahead reports one match per start position,
+# the longest phrase there (shorter phrases sharing that start are not seen,
+# which _check_keyword_prefixes guarantees cannot change any score); phrases
+# starting at other positions, including overlapping ones, are all seen
+_TOOL_KEYWORD_RE = re.compile(
+    "(?=(" + "|".join(
+        re.escape(keyword) for keyword in sorted(_TOOL_KEYWORD_HITS, key=len, reverse=True)
+    ) + "))"
+)
+
+
+# ============================================================================
+# PERSONA CACHE - Identical quiz answers map to the same profile
+# ============================================================================
+
+class PersonaCache:
+    """
+    Process-local LRU cache of generated personality profiles.
+    
+    Quiz answers are discrete choices, so the same answers (with the same
+    prompt version and model settings) always describe the same personality.
+    Entries are plain profile dicts without `generated_at`, so every hit gets
+    a fresh timestamp from the model default.
+    """
+    
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the cached profile dict, or None on miss/expiry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return copy.deepcopy(entry[1])
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size, for the stats endpoint"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+    
+    def set(self, key: str, profile_dict: Dict[str, Any], ttl: Optional[float] = None):
+        """Store a profile dict, evicting the least recently used entry when full"""
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.ttl_seconds)
+        with self._lock:
+            self._entries[key] = (expires_at, copy.deepcopy(profile_dict))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# ============================================================================
+# LANGCHAIN PERSONA ARCHITECT
+# ============================================================================
+
+# Attributes created together by LangChainPersonaArchitect._build_llm_clients
+_LLM_ATTRIBUTES = frozenset({"llm", "chat_llm", "summary_llm", "chain", "batch_chain", "stream_chain"})
+
+class LangChainPersonaArchitect:
+    """
+    LangChain-based persona architect using Google Gemini 2.0 Flash
+    for intelligent quiz analysis and persona generation.
+    """
+    
+    def __init__(
+        self,
+        google_api_key: str,
+        model_name: str = "gemini-2.5-flash",
+        temperature: float = 0.5,
+        persona_cache: Optional[PersonaCache] = None,
+        max_output_tokens: Optional[int] = None,
+        thinking_budget: Optional[int] = None,
+        escalation_model_name: Optional[str] = None,
+        requests_per_second: Optional[float] = None,
+        summary_model_name: Optional[str] = None,
+        max_retries: Optional[int] = None
+    ):
+        """
+        Initialize LangChain persona architect with Gemini.
+        
+        Args:
+            google_api_key: Google API key for Gemini
+            model_name: Gemini model to use (default: gemini-2.5-flash)
+            temperature: Model temperature (0.0-1.0)
+            persona_cache: Cache for generated profiles (default: in-process PersonaCache)
+            max_output_tokens: Hard cap on generated tokens per call (default: model limit)
+            thinking_budget: Gemini 2.5 thinking tokens per call; 0 disables thinking
+                for lower time-to-first-token (default: model decides)
+            escalation_model_name: Stronger Gemini model retried only when the
+                primary model's profile fails schema validation (default: none)
+            requests_per_second: Client-side token-bucket limit shared by every
+                call on the primary model, so bulk fan-out stays under the
+                Gemini quota instead of triggering 429 storms (default: unlimited)
+            summary_model_name: Lighter Gemini model for the background
+                conversation summary (default: the primary model)
+            max_retries: Attempts per Gemini call; 429/5xx and transport errors
+                are retried with exponential backoff and jitter by the client
+                (default: client default of 6)
+        """
+        self.model_name = model_name
+        self.temperature = temperature
+        self.persona_cache = persona_cache if persona_cache is not None else PersonaCache()
+        self.escalation_count = 0
+        
+        # Gemini clients and chains are built on first use (see __getattr__):
+        # importing langchain_google_genai dominates cold start, and requests
+        # that never call the model should not pay for it
+        self._google_api_key = google_api_key
+        self._max_output_tokens = max_output_tokens
+        self._thinking_budget = thinking_budget
+        self._escalation_model_name = escalation_model_name
+        self._requests_per_second = requests_per_second
+        self._summary_model_name = summary_model_name
+        self._max_retries = max_retries
+        self._llm_lock = threading.Lock()
+    
+    def __getattr__(self, name: str) -> Any:
+        # Only reached while a lazy attribute has not been built yet
+        if name in _LLM_ATTRIBUTES:
+            with self.__dict__["_llm_lock"]:
+                if name not in self.__dict__:
+                    self._build_llm_clients()
+            return self.__dict__[name]
+        raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+    
+    def warmup(self):
+        """Build the Gemini clients ahead of the first request (no model call is made)"""
+        self.llm  # First access runs _build_llm_clients
+    
+    async def awarmup(self):
+        """
+        Build the Gemini clients off the event loop, then open the async
+        client's keep-alive connection with a model-metadata request
+        (no tokens are generated or billed). Failures are logged, not raised.
+        """
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.warmup)
+            await self.llm.client.aio.models.get(model=self.model_name)
+        except Exception as e:
+            print(f"⚠️ Gemini warmup failed: {e}")
+    
+    def _build_llm_clients(self):
+        """Create the Gemini clients and every chain that uses them"""
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        
+        retry_kwargs = {"max_retries": self._max_retries} if self._max_retries is not None else {}
+        llm_kwargs: Dict[str, Any] = dict(
+            model=self.model_name,
+            temperature=self.temperature,
+            google_api_key=self._google_api_key,
+            #convert_system_message_to_human=True
+            top_p=0.8,
+            top_k=40,
+            max_output_tokens=self._max_output_tokens,
+            thinking_budget=self._thinking_budget,
+            rate_limiter=(
+                InMemoryRateLimiter(requests_per_second=self._requests_per_second)
+                if self._requests_per_second else None
+            ),
+            **retry_kwargs
+        )
+        self.llm = ChatGoogleGenerativeAI(**llm_kwargs)
+        
+        # Chat replies are constrained to _CHAT_RESPONSE_SCHEMA at decode time,
+        # so the body is always one bare, well-formed JSON object
+        self.chat_llm = self.llm.bind(
+            response_mime_type="application/json",
+            response_json_schema=_CHAT_RESPONSE_SCHEMA
+        )
+        
+        # Conversation summaries are short, low-temperature compression, so a
+        # lighter non-thinking model with a small output cap is enough. Built
+        # through the constructor so the client and model profile match it
+        summary_kwargs: Dict[str, Any] = {**llm_kwargs, "temperature": 0.2}
+        if self._summary_model_name:
+            summary_kwargs.update(
+                model=self._summary_model_name,
+                thinking_budget=0,
+                max_output_tokens=300,
+                rate_limiter=None
+            )
+        self.summary_llm = ChatGoogleGenerativeAI(**summary_kwargs)
+        
+        # Create the analysis chains. The schema is enforced server-side via
+        # native structured output, so no format instructions go in the prompt.
+        # Messages are assembled directly instead of through a prompt template
+        analysis_messages = RunnableLambda(_analysis_messages)
+        self.chain = analysis_messages | self._structured_llm(PersonalityProfile)
+        
+        # Two-tier routing: the fast model handles the common case and the
+        # stronger model only sees quizzes whose profile failed validation
+        # (OutputParserException and ValidationError are both ValueErrors)
+        if self._escalation_model_name:
+            # Built through the constructor rather than model_copy, so the
+            # model's validators derive the client and model profile for the
+            # escalation model instead of inheriting the primary model's
+            escalation_llm = ChatGoogleGenerativeAI(**{
+                **llm_kwargs,
+                "model": self._escalation_model_name,
+                "thinking_budget": None,
+                "rate_limiter": None,
+            })
+            escalation_chain = (
+                RunnableLambda(self._note_escalation)
+                | analysis_messages
+                | self._structured_llm(PersonalityProfile, escalation_llm)
+            )
+            self.chain = self.chain.with_fallbacks(
+                [escalation_chain], exceptions_to_handle=(ValueError,)
+            )
+        
+        # Batch variant: several users' quizzes analyzed in a single LLM call
+        # so the static system prompt is only sent (and billed) once per batch
+        self.batch_chain = (
+            RunnableLambda(_batch_analysis_messages)
+            | self._structured_llm(PersonalityProfileBatch)
+        )
+        
+        # Streaming variant: a dict schema makes the structured-output parser a
+        # JsonOutputParser, which yields partial dicts as the JSON is written
+        self.stream_chain = (
+            analysis_messages
+            | self.llm.with_structured_output(
+                _schema_for_llm(PersonalityProfile.model_json_schema()), method="json_schema"
+            )
+        )
+    
+    def _structured_llm(self, schema: type, llm: Optional["ChatGoogleGenerativeAI"] = None):
+        """LLM bound to `schema` via JSON-schema mode, falling back to function calling"""
+        llm = llm or self.llm
+        # The compact (description-free) schema goes to Gemini; the returned
+        # dict is still validated against the full model
+        json_schema_llm = (
+            llm.with_structured_output(_schema_for_llm(schema.model_json_schema()), method="json_schema")
+            | RunnableLambda(schema.model_validate)
+        )
+        # Only a malformed or invalid profile is retried (parser and pydantic
+        # errors are ValueErrors); rate limits, timeouts and network errors
+        # (already retried by the client) propagate instead of paying for a
+        # second full generation
+        return json_schema_llm.with_fallbacks(
+            [llm.with_structured_output(schema, method="function_calling")],
+            exceptions_to_handle=(ValueError,)
+        )
+    
+    def _note_escalation(self, quiz_text: str) -> str:
+        """Count and log a fall-through to the escalation model"""
+        self.escalation_count += 1
+        print(f"⚠️ Persona profile failed validation, escalating (total escalations: {self.escalation_count})")
+        return quiz_text
+    
+    def generate_persona(
+        self,
+        user_id: str,
+        quiz_data: Dict[int, str]
+    ) -> UserPersona:
+        """
+        Generate complete user persona from quiz responses.
+        
+        Args:
+            user_id: Unique user ID from Firebase Auth
+            quiz_data: Dictionary mapping question IDs to selected answers
+                      e.g., {1: "a", 2: "c", 3: "b", ...}
+        
+        Returns:
+            UserPersona with personality_profile and live_user_state
+        """
+        # Identical answers -> identical profile, skip the LLM entirely
+        cache_key = self._persona_cache_key(quiz_data)
+        cached = self._persona_from_cache(user_id, cache_key)
+        if cached is not None:
+            return cached
+        
+        # Format quiz responses for LLM analysis
+        quiz_text = self._format_quiz_for_analysis(quiz_data)
+        
+        # Run LangChain analysis (generated_at is stamped during validation)
+        personality_profile = self.chain.invoke(quiz_text)
+        
+        persona = self._build_persona(user_id, personality_profile)
+        self._remember_profile(cache_key, persona)
+        return persona
+    
+    async def agenerate_persona(
+        self,
+        user_id: str,
+        quiz_data: Dict[int, str]
+    ) -> UserPersona:
+        """
+        Async version of generate_persona() using the chain's ainvoke, so the
+        Gemini round-trip does not block the event loop.
+        
+        Args:
+            user_id: Unique user ID from Firebase Auth
+            quiz_data: Dictionary mapping question IDs to selected answers
+        
+        Returns:
+            UserPersona with personality_profile and live_user_state
+        """
+        cache_key = self._persona_cache_key(quiz_data)
+        cached = self._persona_from_cache(user_id, cache_key)
+        if cached is not None:
+            return cached
+        
+        quiz_text = self._format_quiz_for_analysis(quiz_data)
+        
+        personality_profile = await self.chain.ainvoke(quiz_text)
+        
+        persona = self._build_persona(user_id, personality_profile)
+        self._remember_profile(cache_key, persona)
+        return persona
+    
+    async def astream_persona(
+        self,
+        user_id: str,
+        quiz_data: Dict[int, str]
+    ) -> AsyncIterator[Union[Dict[str, Any], UserPersona]]:
+        """
+        Stream persona generation for interactive onboarding.
+        
+        Yields partial profile dicts as the model writes them, then the
+        validated UserPersona as the final item. A cache hit yields only the
+        persona.
+        
+        Args:
+            user_id: Unique user ID from Firebase Auth
+            quiz_data: Dictionary mapping question IDs to selected answers
+        """
+        cache_key = self._persona_cache_key(quiz_data)
+        cached = self._persona_from_cache(user_id, cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        quiz_text = self._format_quiz_for_analysis(quiz_data)
+        
+        profile_dict: Dict[str, Any] = {}
+        async for partial in self.stream_chain.astream(quiz_text):
+            profile_dict = partial
+            yield partial
+        
+        persona = self._build_persona(user_id, PersonalityProfile.model_validate(profile_dict))
+        self._remember_profile(cache_key, persona)
+        yield persona
+    
+    async def agenerate_personas(
+        self,
+        users: List[Tuple[str, Dict[int, str]]],
+        max_concurrency: int = 16
+    ) -> List[Union[UserPersona, BaseException]]:
+        """
+        Generate personas for many users concurrently (one LLM call each).
+        
+        Cached answers are served directly, and users with identical answers
+        share a single call; the rest fan out through `chain.abatch`.
+        
+        Args:
+            users: List of (user_id, quiz_data) tuples
+            max_concurrency: Maximum number of in-flight Gemini calls
+        
+        Returns:
+            List in the same order as `users`; failed entries hold the exception
+            instead of a UserPersona
+        """
+        results: List[Union[UserPersona, BaseException, None]] = [None] * len(users)
+        
+        # cache key -> indices of users waiting on that LLM result
+        pending: Dict[str, List[int]] = {}
+        for index, (user_id, quiz_data) in enumerate(users):
+            cache_key = self._persona_cache_key(quiz_data)
+            if cache_key not in pending:
+                results[index] = self._persona_from_cache(user_id, cache_key)
+                if results[index] is not None:
+                    continue
+            pending.setdefault(cache_key, []).append(index)
+        
+        if not pending:
+            return results
+        
+        cache_keys = list(pending)
+        quiz_texts = [self._format_quiz_for_analysis(users[pending[key][0]][1]) for key in cache_keys]
+        profiles = await self.chain.abatch(
+            quiz_texts,
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True
+        )
+        
+        for cache_key, profile in zip(cache_keys, profiles):
+            indices = pending[cache_key]
+            if isinstance(profile, BaseException):
+                for index in indices:
+                    results[index] = profile
+                continue
+            for index in indices:
+                persona = self._build_persona(users[index][0], profile.model_copy(deep=True))
+                results[index] = persona
+            self._remember_profile(cache_key, results[indices[0]])
+        
+        return results
+    
+    def generate_personas_batch(
+        self,
+        users: List[Tuple[str, Dict[int, str]]]
+    ) -> List[UserPersona]:
+        """
+        Generate personas for several users, packing up to MAX_PERSONA_BATCH_SIZE
+        quizzes into each LLM call.
+        
+        Args:
+            users: List of (user_id, quiz_data) tuples
+        
+        Returns:
+            List of UserPersona objects in the same order as `users`
+        """
+        personas: List[Optional[UserPersona]] = [None] * len(users)
+        
+        # Serve cached profiles first; only the misses go to the LLM
+        misses = []
+        for index, (user_id, quiz_data) in enumerate(users):
+            personas[index] = self._persona_from_cache(user_id, self._persona_cache_key(quiz_data))
+            if personas[index] is None:
+                misses.append(index)
+        
+        for start in range(0, len(misses), MAX_PERSONA_BATCH_SIZE):
+            chunk_indices = misses[start:start + MAX_PERSONA_BATCH_SIZE]
+            chunk = [users[index] for index in chunk_indices]
+            for index, persona in zip(chunk_indices, self._generate_persona_chunk(chunk)):
+                personas[index] = persona
+        
+        return personas
+    
+    def _generate_persona_chunk(
+        self,
+        chunk: List[Tuple[str, Dict[int, str]]]
+    ) -> List[UserPersona]:
+        """Run one batch LLM call; fall back to per-user calls if the output is malformed"""
+        quizzes_text = "\n".join(
+            f"=== Quiz {i} ===\n{self._format_quiz_for_analysis(quiz_data)}"
+            for i, (_, quiz_data) in enumerate(chunk, start=1)
+        )
+        
+        try:
+            result = self.batch_chain.invoke({"quizzes": quizzes_text, "n": len(chunk)})
+            profiles = result.profiles if result is not None else []
+            if len(profiles) != len(chunk):
+                raise ValueError(f"Expected {len(chunk)} profiles, got {len(profiles)}")
+            
+            personas = [
+                self._build_persona(user_id, personality_profile)
+                for (user_id, _), personality_profile in zip(chunk, profiles)
+            ]
+            for (_, quiz_data), persona in zip(chunk, personas):
+                self._remember_profile(self._persona_cache_key(quiz_data), persona)
+            return personas
+        except ValueError as e:
+            # Covers OutputParserException and pydantic ValidationError
+            print(f"⚠️ Batch persona generation failed ({e}), falling back to per-user calls")
+            return [self.generate_persona(user_id, quiz_data) for user_id, quiz_data in chunk]
+    
+    def _persona_cache_key(self, quiz_data: Dict[int, str]) -> str:
+        """SHA-256 of the canonicalised answers plus everything that shapes the output"""
+        canonical = orjson.dumps(
+            {
+                "quiz": sorted((int(q_id), answer) for q_id, answer in quiz_data.items()),
+                "v": PROMPT_VERSION,
+                "model": self.model_name,
+                "t": self.temperature,
+            },
+            option=orjson.OPT_SORT_KEYS
+        )
+        return hashlib.sha256(canonical).hexdigest()
+    
+    def _persona_from_cache(self, user_id: str, cache_key: str) -> Optional[UserPersona]:
+        """Build a persona from a cached profile, or return None on miss"""
+        profile_dict = self.persona_cache.get(cache_key)
+        if profile_dict is None:
+            return None
+        # Cached dicts are dumps of already-validated profiles, so skip re-validation
+        return self._build_persona(user_id, PersonalityProfile.model_construct(**profile_dict))
+    
+    def _remember_profile(self, cache_key: str, persona: UserPersona):
+        """Cache the generated profile (without its per-user timestamp)"""
+        self.persona_cache.set(
+            cache_key,
+            persona.personality_profile.model_dump(mode="json", exclude={"generated_at"})
+        )
+    
+    def _build_persona(self, user_id: str, personality_profile: PersonalityProfile) -> UserPersona:
+        """Assemble a fresh UserPersona from a validated personality profile"""
+        # Create initial LiveUserState
+        live_user_state = LiveUserState.fresh(
+            current_mood=Mood.NEUTRAL,
+            last_interaction="onboarding"
+        )
+        
+        # Combine into UserPersona (both parts are validated model instances)
+        persona = UserPersona.model_construct(
+            user_id=user_id,
+            personality_profile=personality_profile,
+            live_user_state=live_user_state
+        )
+        
+        return persona
+    
+    def _format_quiz_for_analysis(self, quiz_data: Dict[int, str]) -> str:
+        """Format quiz responses into readable text for LLM analysis"""
+        return "User Quiz Responses:\n\n" + "".join(
+            _QUIZ_ANSWER_LINES.get((q_id, answer))
+            or f"Q{q_id}: {_QUIZ_QUESTIONS.get(q_id, f'Question {q_id}')}\n"
+               f"Answer: {_QUIZ_ANSWER_INTERPRETATIONS.get((q_id, answer), f'Answer {answer}')}\n\n"
+            for q_id, answer in sorted(quiz_data.items())
+        )
+    
+    def update_user_state(
+        self,
+        current_state: LiveUserState,
+        action: Dict[str, Any]
+    ) -> LiveUserState:
+        """
+        Update live user state based on wellness tool actions.
+        
+        Supported action types:
+        - chat_message: General chat interaction
+        - tool_use: Generic tool usage
+        - sleep_log: Sleep tracking
+        - breathing_exercise: From breathing_service (4-7-8, Diaphragmatic, Box, etc.)
+        - grounding_technique: From grounding_service (5-4-3-2-1, Body Scan, etc.)
+        - mindfulness_meditation: From mindfulness_service (Body Scan, Mindful Walking, Mindful Eating)
+        - body_relaxation: From body_relaxation_service (Body Mapping, Wave Breathing, Self-Hug)
+        
+        Args:
+            current_state: Current LiveUserState
+            action: Dictionary with "type" and "content" (exercise data from Firebase)
+        
+        Returns:
+            Updated LiveUserState
+        """
+        action_type = action.get("type", "unknown").lower()
+        content = action.get("content", {})
+        
+        handler = _STATE_HANDLERS.get(action_type)
+        if handler is not None:
+            handler(current_state, action, content)
+        
+        # Update timestamp (one clock read so both fields agree)
+        now = datetime.now(timezone.utc).isoformat()
+        current_state.last_interaction_timestamp = now
+        current_state.last_updated = now
+        
+        return current_state
+    
+    def summarize_history(
+        self,
+        state: LiveUserState,
+        older_messages: List[Dict[str, Any]]
+    ) -> bool:
+        """
+        Fold chat turns that left the recent-history window into the rolling
+        conversation summary.
+        
+        This is a blocking LLM call on purpose: it runs inside main.py's sync
+        chat background task, which Starlette executes in its threadpool after
+        the response is sent and which already makes blocking Firestore writes.
+        It holds that worker thread, never the event loop, and keeps the new
+        summary in the same delta write as the live-state update.
+        
+        Messages are matched on the key the history loader uses for each
+        message's created_at ("timestamp"); messages without one are skipped.
+        
+        Args:
+            state: LiveUserState to update in place
+            older_messages: Chronological messages older than the recent window
+        
+        Returns:
+            True if the summary was updated
+        """
+        new_messages = [
+            msg for msg in older_messages
+            if msg.get("timestamp") and str(msg["timestamp"]) > state.summarized_through
+        ]
+        if len(new_messages) < _SUMMARY_MIN_MESSAGES:
+            return False
+        
+        transcript = "\n".join(
+            f"{'User' if msg.get('role') == 'user' else 'Serebot'}: {msg.get('content', '')}"
+            for msg in new_messages
+        )
+        resp = self.summary_llm.invoke([
+            SystemMessage(content=_SUMMARY_SYSTEM_PROMPT),
+            HumanMessage(content=(
+                f"Current summary:\n{state.conversation_summary or '(none yet)'}\n\n"
+                f"New turns:\n{transcript}"
+            ))
+        ])
+        summary = resp.content.strip() if isinstance(resp.content, str) else ""
+        if not summary:
+            return False
+        
+        state.conversation_summary = summary[:_MAX_SUMMARY_CHARS]
+        state.summarized_through = str(new_messages[-1]["timestamp"])
+        return True
+    
+    def _analyze_user_sentiment(
+        self,
+        state: LiveUserState,
+        key_insights: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
+        """
+        Analyze user's current sentiment and generate adaptive communication guidance.
+        
+        Args:
+            state: Current LiveUserState
+            key_insights: Recent key moments
+            
+        Returns:
+            Sentiment-specific communication guidance
+        """
+        mood = state.current_mood.value
+        stressors_text = " ".join(state.recent_stressors).lower()
+        
+        # Analyze recent insights for crisis indicators
+        crisis = any(
+            insight.get('type') in _CRISIS_INSIGHT_TYPES for insight in key_insights or []
+        )
+        
+        # First matching rule wins
+        for matches, guidance in _SENTIMENT_RULES:
+            if matches(state, mood, stressors_text, crisis):
+                return guidance
+        return _SENTIMENT_NEW_USER
     
     def chat(
         self,
@@ -784,7 +1627,7 @@ The system prompt should be comprehensive (300-500 words) and include:
         chat_history: Optional[List[Dict[str, str]]] = None,
         key_insights: Optional[List[Dict[str, Any]]] = None,
         user_full_name: Optional[str] = None
-    ) -> tuple[str, Dict[str, float]]:
+    ) -> Tuple[str, Dict[str, float]]:
         """
         Generate AI response based on user's persona, chat history, and key insights.
         Ultra-optimized version with minimal token usage.
@@ -792,40 +1635,126 @@ The system prompt should be comprehensive (300-500 words) and include:
         Returns:
             Tuple of (response_text, recommended_tools_dict)
         """
+        messages = self._build_chat_messages(user_message, persona, chat_history, key_insights, user_full_name)
+        try:
+            return self._parse_chat_reply(self.chat_llm.invoke(messages))
+        except Exception as e:
+            print(f"❌ Chat Error: {e}")
+            import traceback
+            traceback.print_exc()
+            return "I'm here with you.", self._get_default_tools()
+    
+    async def achat(
+        self,
+        user_message: str,
+        persona: UserPersona,
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        key_insights: Optional[List[Dict[str, Any]]] = None,
+        user_full_name: Optional[str] = None
+    ) -> Tuple[str, Dict[str, float]]:
+        """
+        Async version of chat() using ainvoke, so concurrent chat turns
+        interleave on the event loop instead of each holding a worker thread.
+        
+        Returns:
+            Tuple of (response_text, recommended_tools_dict)
+        """
+        messages = self._build_chat_messages(user_message, persona, chat_history, key_insights, user_full_name)
+        try:
+            return self._parse_chat_reply(await self.chat_llm.ainvoke(messages))
+        except Exception as e:
+            print(f"❌ Chat Error: {e}")
+            import traceback
+            traceback.print_exc()
+            return "I'm here with you.", self._get_default_tools()
+    
+    async def achat_stream(
+        self,
+        user_message: str,
+        persona: UserPersona,
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        key_insights: Optional[List[Dict[str, Any]]] = None,
+        user_full_name: Optional[str] = None
+    ) -> AsyncIterator[Union[str, Tuple[str, Dict[str, float]]]]:
+        """
+        Streaming version of achat() for lower time-to-first-token.
+        
+        Yields pieces of the reply text as the model writes its "response"
+        field, then the (response_text, recommended_tools_dict) tuple parsed
+        from the complete output as the final item. Tool scores only arrive
+        at the end because they need the full JSON. If the stream fails after
+        some text was sent, the final item keeps that partial text.
+        """
+        messages = self._build_chat_messages(user_message, persona, chat_history, key_insights, user_full_name)
+        raw_text = ""
+        sent = ""
+        try:
+            async for chunk in self.chat_llm.astream(messages):
+                if not isinstance(chunk.content, str):
+                    continue
+                raw_text += chunk.content
+                
+                # Reply text so far, read from the partial JSON object
+                try:
+                    partial = parse_partial_json(raw_text)
+                except ValueError:
+                    continue  # Not JSON (yet); the final parse handles it
+                reply = partial.get("response") if isinstance(partial, dict) else None
+                if isinstance(reply, str) and len(reply) > len(sent) and reply.startswith(sent):
+                    yield reply[len(sent):]
+                    sent = reply
+            
+            response, tools = self._parse_chat_reply(raw_text)
+        except Exception as e:
+            print(f"❌ Chat Stream Error: {e}")
+            import traceback
+            traceback.print_exc()
+            if sent:
+                # The user has already seen part of the reply: finish on it
+                # (scored like a cut-off reply) instead of swapping it out
+                response, tools = sent, self._legacy_fallback_tool_extraction(sent)
+            else:
+                response, tools = "I'm here with you.", self._get_default_tools()
+        
+        # Send whatever the incremental parse missed (or the fallback reply)
+        if response.startswith(sent) and len(response) > len(sent):
+            yield response[len(sent):]
+        yield response, tools
+    
+    def _build_chat_messages(
+        self,
+        user_message: str,
+        persona: UserPersona,
+        chat_history: Optional[List[Dict[str, str]]],
+        key_insights: Optional[List[Dict[str, Any]]],
+        user_full_name: Optional[str]
+    ) -> List[BaseMessage]:
+        """Assemble the system prompt, recent history and user turn for one chat call"""
         chat_history = chat_history or []
         key_insights = key_insights or []
         
         # --- Detect follow-up marker from main.py ---
-        import re
         follow_up_minutes = None
         if user_message.startswith("[FOLLOW_UP:"):
-            match = re.match(r'\[FOLLOW_UP:(\d+)min\] (.*)', user_message)
+            match = _FOLLOW_UP_RE.match(user_message)
             if match:
                 follow_up_minutes = match.group(1)
                 user_message = match.group(2)  # Remove marker from actual message
-                print(f"🔔 Follow-up context detected: {follow_up_minutes} minutes ago")
         
         # --- Build minimal persona context ---
         p = persona.personality_profile
         s = persona.live_user_state
 
-        persona_ctx = (
-            f"style={p.communication_style.value}, "
-            f"stressor={p.primary_stressor.value}, "
-            f"social={p.social_profile.value}, "
-            f"coping={p.coping_mechanism.value}, "
-            f"level={p.stress_level.value}, "
+        state_ctx = (
             f"mood={s.current_mood.value}, "
             f"recent={','.join(s.recent_stressors) or 'none'}, "
             f"checkin={s.needs_check_in}"
         )
 
         # --- Short insights (max 3) ---
-        insights = ""
-        if key_insights:
-            last = key_insights[-3:]
-            items = [f"{i.get('type', 'note')}: {i.get('content', '')}" for i in last]
-            insights = " | ".join(items)
+        insights = " | ".join(
+            f"{i.get('type', 'note')}: {i.get('content', '')}" for i in key_insights[-3:]
+        )
 
         # --- Build follow-up instruction if detected ---
         follow_up_instruction = ""
@@ -842,146 +1771,84 @@ Be gentle, caring, and show genuine interest in their wellbeing after your last
 """
 
         # --- Ultra-optimized system prompt ---
+        # Shared static block, then this user's stable details, then the
+        # per-turn parts, so repeat turns share the longest possible prefix
         name_str = user_full_name if user_full_name else "User"
-        system_prompt = f"""
-You are Serebot — a calm, soft, empathetic, gentle wellbeing companion created by Avni Singhal (LinkedIn: https://www.linkedin.com/in/avnisinghal001 | GitHub: https://github.com/avnisinghal001).
-
-ALWAYS address the user by only their first name(strictly first name only before the first space) from (**{name_str}**) in every response to create a personal touch. The name is fetched using the get_user_full_name function for personalization.
-{follow_up_instruction}
-Soothe first: create emotional safety and validation.
-Guide second: offer thoughtful, actionable, and realistic steps.
-offer 2–3 gentle, grounded steps.
-Empower third: encourage progress and autonomy, never dependency.
-
-Use persona + key insights only when they naturally fit the user's current emotional state.
-Respond briefly, softly, and with emotional clarity.
-No medical claims, no diagnosis, no fabricated facts; if unsure, say so honestly.
-If user expresses crisis, self-harm, or severe distress → respond with immediate compassion, validate their feelings without minimising, and urgently direct them to professional support: AASRA: +91-9820466726, iCall: +91-9152987821. Remind them that you are a wellness companion, not a crisis or clinical service.
-
-You MUST output ONLY a JSON object, and the "response" field MUST be written in clean, readable Markdown (formatted like a beautiful Markdown message). Do NOT add any text outside the JSON object:
-{{{{
-  "response": "<empathetic reply: validate the user's feelings, offer gentle support and grounded wellness suggestions as a caring peer companion — never diagnose or claim clinical authority>",
-  "recommended_tools": {{{{
-    "diaphragmatic_breathing": 0-100,
-    "box_breathing": 0-100,
-    "four_seven_eight_breathing": 0-100,
-    "pursed_lip_breathing": 0-100,
-    "body_mapping": 0-100,
-    "wave_breathing": 0-100,
-    "self_hug": 0-100,
-    "five_four_three_two_one": 0-100,
-    "texture_focus": 0-100,
-    "mental_grounding": 0-100,
-    "body_scan_meditation": 0-100,
-    "mindful_walking": 0-100,
-    "mindful_eating": 0-100
-  }}}}
-}}}}
-
-Tool scoring logic:
-- 90–100: explicitly suggested
-- 70–89: strong emotional match
-- 50–69: moderate relevance
-- 30–49: weak relevance
-- 10–29: minimal match
-- 0–9: not relevant
-
-Emotion→tool mapping:
-diaphragmatic_breathing=anxiety/overwhelm
-box_breathing=focus_loss/exam_stress
-four_seven_eight_breathing=insomnia/night_anxiety
-pursed_lip_breathing=panic_spike
-body_mapping=body_tension/heaviness
-wave_breathing=agitation
-self_hug=self_blame/lonely
-five_four_three_two_one=panic/dissociation/overstim
-texture_focus=public_anxiety/subtle_grounding
-mental_grounding=rumination/loops
-body_scan_meditation=fatigue/bedtime
-mindful_walking=stuck/restless
-mindful_eating=emotional_eating/appetite_issues
-
-Context: {persona_ctx}
+        summary_line = f"Earlier conversations: {s.conversation_summary}\n" if s.conversation_summary else ""
+        system_prompt = _chat_system_prefix(name_str, p.chat_context) + summary_line + f"""{follow_up_instruction}
+State: {state_ctx}
 Insights: {insights}
 """
 
         # --- Build conversation messages ---
-        messages = [("system", system_prompt)]
+        # Message objects go straight to the LLM: no per-turn template
+        # compilation, and braces in user text are never parsed as variables
+        messages = [SystemMessage(content=system_prompt)]
 
-        # Add recent chat history (last 5 messages already filtered in main.py)
-        for msg in chat_history:
-            role = "human" if msg.get("role") == "user" else "assistant"
-            messages.append((role, msg.get("content", "")))
+        # Add recent chat history (last 5 messages already filtered in main.py),
+        # newest first until the token budget is spent
+        history_messages = []
+        budget = _CHAT_HISTORY_TOKEN_BUDGET
+        for msg in reversed(chat_history):
+            content = msg.get("content", "")
+            budget -= _estimate_tokens(content)
+            if budget < 0:
+                break
+            message_cls = HumanMessage if msg.get("role") == "user" else AIMessage
+            history_messages.append(message_cls(content=content))
+        messages.extend(reversed(history_messages))
 
-        messages.append(("human", user_message))
+        messages.append(HumanMessage(content=user_message))
+        return messages
+    
+    def _parse_chat_reply(self, resp: Any) -> Tuple[str, Dict[str, float]]:
+        """Extract the reply text and validated tool scores from the LLM message"""
+        text = resp.content if hasattr(resp, "content") else str(resp)
 
-        # --- LLM call ---
         try:
-            prompt = ChatPromptTemplate.from_messages(messages)
-            resp = (prompt | self.llm).invoke({})
-            text = resp.content if hasattr(resp, "content") else str(resp)
-
             data = self._extract_json_from_response(text)
+        except ValueError:
+            # Cut-off JSON (e.g. max_output_tokens reached): keep the reply
+            # text written so far and score tools from it by keyword
+            try:
+                partial = parse_partial_json(text)
+            except ValueError:
+                partial = None
+            reply = partial.get("response") if isinstance(partial, dict) else None
+            if not isinstance(reply, str) or not reply.strip():
+                raise
+            print("⚠️ Chat reply was not complete JSON - using keyword tool scores")
+            return reply, self._legacy_fallback_tool_extraction(reply)
 
-            response = data.get("response", "I'm here with you.")
-            tools = data.get("recommended_tools", self._get_default_tools())
-            tools = self._validate_tool_scores(tools)
-
-            return response, tools
+        # _extract_json_from_response guarantees both keys, so no default
+        # tool dict is built just to be discarded
+        response = data.get("response", "I'm here with you.")
+        tools = self._validate_tool_scores(data["recommended_tools"])
 
-        except Exception as e:
-            print(f"❌ Chat Error: {e}")
-            import traceback
-            traceback.print_exc()
-            return "I'm here with you.", self._get_default_tools()
+        return response, tools
     
     def _extract_json_from_response(self, text: str) -> Dict[str, Any]:
-        """Extract JSON object from LLM response that may contain extra text"""
-        import json
-        import re
-        
-        # Try to find JSON object in the response
-        # Look for pattern: { ... } with proper nesting
-        json_pattern = r'\{(?:[^{}]|\{(?:[^{}]|\{[^{}]*\})*\})*\}'
-        matches = re.findall(json_pattern, text, re.DOTALL)
-        
-        # Try each match (usually the largest one is the complete JSON)
-        for match in reversed(matches):  # Start with longest matches
-            try:
-                parsed = json.loads(match)
-                # Verify it has the expected structure
-                if "response" in parsed and "recommended_tools" in parsed:
-                    return parsed
-            except json.JSONDecodeError:
-                continue
+        """Parse the chat reply object (constrained decoding makes it the whole body)"""
+        try:
+            parsed = orjson.loads(text)
+        except orjson.JSONDecodeError:
+            parsed = None
+        if isinstance(parsed, dict) and "response" in parsed and "recommended_tools" in parsed:
+            return parsed
         
-        # If no valid JSON found, raise error
+        # Cut-off or malformed output; _parse_chat_reply salvages what it can
         raise ValueError(f"Could not extract valid JSON from response: {text[:200]}...")
     
     def _get_default_tools(self) -> Dict[str, float]:
         """Return default tool scores (all 0.0)"""
-        return {
-            "diaphragmatic_breathing": 0.0,
-            "box_breathing": 0.0,
-            "four_seven_eight_breathing": 0.0,
-            "pursed_lip_breathing": 0.0,
-            "body_mapping": 0.0,
-            "wave_breathing": 0.0,
-            "self_hug": 0.0,
-            "five_four_three_two_one": 0.0,
-            "texture_focus": 0.0,
-            "mental_grounding": 0.0,
-            "body_scan_meditation": 0.0,
-            "mindful_walking": 0.0,
-            "mindful_eating": 0.0
-        }
+        return dict(_DEFAULT_TOOL_SCORES)
     
     def _validate_tool_scores(self, tools: Dict[str, float]) -> Dict[str, float]:
         """Validate and sanitize tool scores to ensure all tools present with valid ranges"""
-        default_tools = self._get_default_tools()
+        default_tools = dict(_DEFAULT_TOOL_SCORES)
         
         # Update with provided scores, ensuring valid range
-        for key in default_tools:
+        for key in _DEFAULT_TOOL_SCORES:
             if key in tools:
                 try:
                     score = float(tools[key])
@@ -997,116 +1864,18 @@ Insights: {insights}
     def _legacy_fallback_tool_extraction(self, response_text: str) -> Dict[str, float]:
         """
         LEGACY: Keyword-based tool extraction (kept for emergency fallback).
-        NOTE: Should never be called - structured output handles this automatically.
-        If you see this being called, there's a problem with JsonOutputParser.
+        NOTE: Only used by _parse_chat_reply when the model's JSON is cut off
+        before "recommended_tools"; the normal path reads the model's scores.
         """
         # Initialize all tools at 0
-        tools = {
-            "diaphragmatic_breathing": 0.0,
-            "box_breathing": 0.0,
-            "four_seven_eight_breathing": 0.0,
-            "pursed_lip_breathing": 0.0,
-            "body_mapping": 0.0,
-            "wave_breathing": 0.0,
-            "self_hug": 0.0,
-            "five_four_three_two_one": 0.0,
-            "texture_focus": 0.0,
-            "mental_grounding": 0.0,
-            "body_scan_meditation": 0.0,
-            "mindful_walking": 0.0,
-            "mindful_eating": 0.0
-        }
+        tools = self._get_default_tools()
         
         response_lower = response_text.lower()
         
-        # Keyword mappings with scores
-        keyword_scores = {
-            # Breathing exercises
-            "diaphragmatic_breathing": [
-                ("diaphragmatic breathing", 95.0),
-                ("belly breath", 85.0),
-                ("deep breath", 60.0),
-                ("breath deeply", 55.0)
-            ],
-            "box_breathing": [
-                ("box breathing", 95.0),
-                ("4-4-4-4", 90.0),
-                ("equal breath", 70.0)
-            ],
-            "four_seven_eight_breathing": [
-                ("4-7-8 breathing", 95.0),
-                ("four seven eight", 95.0),
-                ("sleep breath", 75.0)
-            ],
-            "pursed_lip_breathing": [
-                ("pursed lip", 95.0),
-                ("pursed-lip", 95.0),
-                ("slow exhale", 70.0),
-                ("gentle exhale", 65.0),
-                ("breathe out slowly", 60.0)
-            ],
-            # Body relaxation
-            "body_mapping": [
-                ("body mapping", 95.0),
-                ("body tension", 70.0),
-                ("where you feel", 60.0)
-            ],
-            "wave_breathing": [
-                ("wave breathing", 95.0),
-                ("wave breath", 90.0),
-                ("rhythmic breath", 65.0)
-            ],
-            "self_hug": [
-                ("self-hug", 95.0),
-                ("self hug", 95.0),
-                ("hug yourself", 85.0),
-                ("self-compassion", 60.0)
-            ],
-            # Grounding techniques
-            "five_four_three_two_one": [
-                ("5-4-3-2-1", 95.0),
-                ("five things", 80.0),
-                ("sensory grounding", 75.0),
-                ("what you see", 65.0),
-                ("notice around you", 55.0)
-            ],
-            "texture_focus": [
-                ("texture focus", 95.0),
-                ("feel the texture", 85.0),
-                ("texture", 70.0),
-                ("touch something", 60.0),
-                ("feeling something physical", 65.0)
-            ],
-            "mental_grounding": [
-                ("mental grounding", 95.0),
-                ("racing thoughts", 70.0),
-                ("slow your thoughts", 65.0)
-            ],
-            # Meditation
-            "body_scan_meditation": [
-                ("body scan", 95.0),
-                ("scan your body", 85.0),
-                ("progressive relaxation", 80.0)
-            ],
-            "mindful_walking": [
-                ("mindful walk", 95.0),
-                ("walking meditation", 90.0),
-                ("mindful step", 80.0)
-            ],
-            "mindful_eating": [
-                ("mindful eat", 95.0),
-                ("mindful meal", 85.0),
-                ("eating meditation", 80.0)
-            ]
-        }
-        
-        # Scan for keywords and assign highest matching score
-        for tool_key, keywords in keyword_scores.items():
-            max_score = 0.0
-            for keyword, score in keywords:
-                if keyword in response_lower:
-                    max_score = max(max_score, score)
-            tools[tool_key] = max_score
+        # Single regex scan; keep the highest matching score per tool
+        for match in _TOOL_KEYWORD_RE.finditer(response_lower):
+            for tool_key, score in _TOOL_KEYWORD_HITS[match.group(1)]:
+                tools[tool_key] = max(tools[tool_key], score)
         
         # Context-based boosting for implicit suggestions
         if any(word in response_lower for word in ["anxiety", "anxious", "panic", "overwhelm"]):
@@ -2,15 +2,15 @@ from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Request
 import asyncio
 import time
 import re
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from firebase_admin import auth as firebase_auth
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 import os
-import json
+import orjson
 from dotenv import load_dotenv
 from langchain_persona_architect import (
     LangChainPersonaArchitect,
@@ -43,6 +43,20 @@ app.add_middleware(
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
 MODEL_NAME = os.getenv("MODEL_NAME", "gemini-2.5-flash")
 MODEL_TEMPERATURE = float(os.getenv("MODEL_TEMPERATURE", "0.5"))
+# Optional latency/cost knobs - unset means the Gemini defaults
+MODEL_MAX_OUTPUT_TOKENS = int(os.getenv("MODEL_MAX_OUTPUT_TOKENS")) if os.getenv("MODEL_MAX_OUTPUT_TOKENS") else None
+MODEL_THINKING_BUDGET = int(os.getenv("MODEL_THINKING_BUDGET")) if os.getenv("MODEL_THINKING_BUDGET") else None
+# Stronger model used only when the primary model's profile fails validation
+# (set to an empty string to disable escalation)
+ESCALATION_MODEL_NAME = os.getenv("ESCALATION_MODEL_NAME", "gemini-2.5-pro") or None
+# Lighter model for the background conversation summary (empty = primary model)
+SUMMARY_MODEL_NAME = os.getenv("SUMMARY_MODEL_NAME", "gemini-2.5-flash-lite") or None
+# Build Gemini clients and open the Firestore channel when the server starts
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+# Client-side request rate cap for the primary model (unset = unlimited)
+GEMINI_REQUESTS_PER_SECOND = float(os.getenv("GEMINI_REQUESTS_PER_SECOND")) if os.getenv("GEMINI_REQUESTS_PER_SECOND") else None
+# Attempts per Gemini call on 429/5xx, with exponential backoff (unset = client default)
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES")) if os.getenv("GEMINI_MAX_RETRIES") else None
 
 if not GOOGLE_API_KEY:
     print("⚠️  WARNING: GOOGLE_API_KEY not set. Persona generation will fail.")
@@ -54,7 +68,13 @@ else:
 persona_architect = LangChainPersonaArchitect(
     google_api_key=GOOGLE_API_KEY,
     model_name=MODEL_NAME,
-    temperature=MODEL_TEMPERATURE
+    temperature=MODEL_TEMPERATURE,
+    max_output_tokens=MODEL_MAX_OUTPUT_TOKENS,
+    thinking_budget=MODEL_THINKING_BUDGET,
+    escalation_model_name=ESCALATION_MODEL_NAME,
+    requests_per_second=GEMINI_REQUESTS_PER_SECOND,
+    summary_model_name=SUMMARY_MODEL_NAME,
+    max_retries=GEMINI_MAX_RETRIES
 )
 
 # Initialize Insight Extractor for long-term memory
@@ -62,6 +82,30 @@ insight_extractor = InsightExtractor()
 print("✅ Insight Extractor initialized")
 
 
+@app.on_event("startup")
+async def warm_up_connections():
+    """
+    Warm the Gemini clients and the Firestore channel in the background.
+    
+    Not awaited, so startup and the first request are never blocked; a
+    request that arrives first simply builds what it needs itself.
+    """
+    if not WARMUP_ON_STARTUP:
+        return
+    
+    async def warm():
+        start_time = time.time()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            persona_architect.awarmup(),
+            loop.run_in_executor(None, firebase_service.warmup)
+        )
+        print(f"🔥 Warmed up Gemini and Firestore connections in {time.time() - start_time:.2f}s")
+    
+    # Keep a reference so the task is not garbage-collected mid-flight
+    app.state.warmup_task = asyncio.create_task(warm())
+
+
 auth_scheme = HTTPBearer(auto_error=False)
 
 
@@ -100,8 +144,10 @@ def require_matching_user(requested_user_id: str, authenticated_uid: str) -> Non
 async def verify_protected_api_token(request: Request, call_next):
     protected_paths = (
         "/api/persona/generate",
+        "/api/persona/generate/stream",
         "/api/persona/update-state",
         "/api/chat",
+        "/api/chat/stream",
     )
     is_body_protected_path = request.url.path in protected_paths
     user_path_match = None
@@ -139,7 +185,7 @@ async def verify_protected_api_token(request: Request, call_next):
     if requested_user_id is None and request.method in {"POST", "PUT", "PATCH"}:
         body_bytes = await request.body()
         try:
-            body = json.loads(body_bytes.decode("utf-8") or "{}")
+            body = orjson.loads(body_bytes or b"{}")
             requested_user_id = body.get("user_id") if isinstance(body, dict) else None
         except Exception:
             requested_user_id = None
@@ -276,8 +322,8 @@ async def generate_persona(
                 detail=f"Invalid quiz data. Expected 10 questions, got {len(request.quiz_data)}"
             )
         
-        # Generate persona using LangChain
-        persona = persona_architect.generate_persona(
+        # Generate persona using LangChain (async Gemini call, non-blocking)
+        persona = await persona_architect.agenerate_persona(
             user_id=request.user_id,
             quiz_data=request.quiz_data
         )
@@ -309,6 +355,62 @@ async def generate_persona(
         )
 
 
+@app.post("/api/persona/generate/stream")
+async def generate_persona_stream(
+    request: GeneratePersonaRequest,
+    authenticated_uid: str = Depends(get_authenticated_uid),
+):
+    """
+    Streaming variant of /api/persona/generate for interactive onboarding.
+    
+    Returns Server-Sent Events: `{"partial": {...}}` events as profile fields
+    are written by the model, then a final `{"done": true, "user_persona": {...}}`
+    event once the profile is validated and saved to Firestore.
+    On failure a single `{"error": "..."}` event is sent.
+    """
+    require_matching_user(request.user_id, authenticated_uid)
+    
+    if not GOOGLE_API_KEY:
+        raise HTTPException(
+            status_code=500,
+            detail="Google API key not configured on server"
+        )
+    
+    if not request.quiz_data or len(request.quiz_data) < 10:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid quiz data. Expected 10 questions, got {len(request.quiz_data)}"
+        )
+    
+    async def event_stream():
+        try:
+            print(f"🔄 Streaming persona generation for user {request.user_id}...")
+            async for item in persona_architect.astream_persona(
+                user_id=request.user_id,
+                quiz_data=request.quiz_data
+            ):
+                if not isinstance(item, UserPersona):
+                    yield b"data: " + orjson.dumps({"partial": item}) + b"\n\n"
+                    continue
+                
+                # Final validated persona: persist once, then close the stream
+                loop = asyncio.get_running_loop()
+                saved = await loop.run_in_executor(None, firebase_service.save_user_persona, item)
+                if not saved:
+                    print(f"⚠️  Persona generated but failed to save to Firebase for user {request.user_id}")
+                await loop.run_in_executor(None, firebase_service.mark_persona_generated, request.user_id)
+                
+                print(f"✅ Persona streamed and saved for user {request.user_id}")
+                final_event = {"done": True, "user_persona": item.model_dump(mode="json")}
+                yield b"data: " + orjson.dumps(final_event) + b"\n\n"
+        except Exception as e:
+            print(f"❌ Error streaming persona: {e}")
+            error_event = {"error": f"Failed to generate persona: {str(e)}"}
+            yield b"data: " + orjson.dumps(error_event) + b"\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @app.get("/api/persona/{user_id}")
 async def get_persona(
     user_id: str,
@@ -382,8 +484,8 @@ async def update_user_state(
     try:
         print(f"🔄 Updating state for user {request.user_id}...")
 
-        # Get current persona
-        persona = firebase_service.get_user_persona(request.user_id)
+        # Get current persona (uncached: the state is modified and written back)
+        persona = firebase_service.get_user_persona(request.user_id, use_cache=False)
         
         if not persona:
             raise HTTPException(
@@ -392,13 +494,14 @@ async def update_user_state(
             )
         
         # Update live state using LangChain architect's logic
+        previous_state = persona.live_user_state.model_dump(mode="json")
         updated_state = persona_architect.update_user_state(
             current_state=persona.live_user_state,
             action=request.action
         )
         
-        # Save updated state to Firebase
-        saved = firebase_service.update_live_state(request.user_id, updated_state)
+        # Save only the changed fields to Firebase
+        saved = firebase_service.update_live_state(request.user_id, updated_state, previous_state)
         
         if not saved:
             raise HTTPException(
@@ -434,11 +537,15 @@ def save_chat_and_update_state(
     ai_response: str,
     recommended_tools: Dict[str, int],
     persona: UserPersona,
-    model_name: str
+    model_name: str,
+    older_history: Optional[List[Dict[str, Any]]] = None
 ):
     """
     Background task to save chat messages and update user state.
     This runs after the response is returned to the user.
+    
+    older_history holds the fetched messages that fell outside the recent
+    window; they are folded into the rolling conversation summary.
     """
     try:
         # Use IST (Indian Standard Time, UTC+5:30)
@@ -492,7 +599,14 @@ def save_chat_and_update_state(
         if insights_saved > 0:
             print(f"💡 Background: Saved {insights_saved} key insights")
         
-        # Update live user state
+        # Update live user state (only changed fields are written). The persona
+        # used for the prompt may be a cached copy, so re-read it uncached:
+        # the changed fields must be computed against what Firestore holds
+        persona = firebase_service.get_user_persona(user_id, use_cache=False)
+        if persona is None:
+            print(f"⚠️ Background: Persona for {user_id} could not be re-read, state not updated")
+            return
+        previous_state = persona.live_user_state.model_dump(mode="json")
         updated_state = persona_architect.update_user_state(
             current_state=persona.live_user_state,
             action={
@@ -501,7 +615,16 @@ def save_chat_and_update_state(
                 "mood": persona.live_user_state.current_mood.value
             }
         )
-        firebase_service.update_live_state(user_id, updated_state)
+        
+        # Fold turns that left the recent window into the rolling summary
+        if older_history:
+            try:
+                if persona_architect.summarize_history(updated_state, older_history):
+                    print(f"🧠 Background: Conversation summary updated for {user_id}")
+            except Exception as e:
+                print(f"⚠️ Background: Failed to update conversation summary: {e}")
+        
+        firebase_service.update_live_state(user_id, updated_state, previous_state)
         
         print(f"✅ Background: Chat saved and state updated for {user_id}")
         
@@ -514,6 +637,97 @@ def save_chat_and_update_state(
 # CHAT ENDPOINT
 # ============================================================================
 
+async def load_chat_context(request: ChatRequest):
+    """
+    Validate a chat request and gather everything the LLM call needs.
+    
+    Shared by /api/chat and /api/chat/stream.
+    
+    Returns:
+        Tuple of (persona, key_insights, recent_history, older_history,
+        user_full_name, user_message_to_send); histories are oldest first
+    """
+    # Check if Google API key is set
+    if not GOOGLE_API_KEY:
+        raise HTTPException(
+            status_code=500,
+            detail="Google API key not configured on server"
+        )
+
+    # Validate message
+    if not request.message or not request.message.strip():
+        raise HTTPException(
+            status_code=400,
+            detail="Message cannot be empty"
+        )
+    
+    # ⚡ Fetch persona, key insights, chat history, and full name in parallel (non-blocking)
+    loop = asyncio.get_event_loop()
+    persona, key_insights, chat_history, user_full_name = await asyncio.gather(
+        loop.run_in_executor(None, firebase_service.get_user_persona, request.user_id),
+        loop.run_in_executor(None, firebase_service.get_relevant_insights, request.user_id, 5),
+        loop.run_in_executor(None, firebase_service.get_chat_history_optimized, request.user_id, 10),
+        loop.run_in_executor(None, firebase_service.get_user_full_name, request.user_id)
+    )
+    
+    if not persona:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No persona found for user {request.user_id}. Generate persona first."
+        )
+    
+    # Get last 5 messages for context
+    recent_history = chat_history[-5:] if len(chat_history) > 5 else chat_history
+    older_history = chat_history[:-5]
+    
+    # ⏰ TIME-BASED CHAT FEATURES
+    # 1. Check if last chat was > 5 hours ago → reset to fresh conversation
+    # 2. Check if last chat was < 1 hour ago → add follow-up personalization
+    user_message_to_send = request.message
+    
+    if chat_history and len(chat_history) > 0:
+        # Get timestamp from most recent message
+        last_msg_timestamp = chat_history[-1].get('timestamp', '')
+        
+        if last_msg_timestamp:
+            from datetime import datetime, timedelta, timezone
+            try:
+                # Parse ISO timestamp with timezone
+                if last_msg_timestamp.endswith('Z'):
+                    last_time = datetime.fromisoformat(last_msg_timestamp.replace('Z', '+00:00'))
+                else:
+                    last_time = datetime.fromisoformat(last_msg_timestamp)
+                
+                # Get current time in same timezone
+                if last_time.tzinfo:
+                    now = datetime.now(last_time.tzinfo)
+                else:
+                    now = datetime.now()
+                
+                time_diff = now - last_time
+                hours_ago = time_diff.total_seconds() / 3600
+                
+                # 5-HOUR RESET WINDOW: Start fresh if > 5 hours
+                if time_diff > timedelta(hours=5):
+                    recent_history = []  # Ignore old history
+                    print(f"⏰ Last chat was {hours_ago:.1f} hours ago - starting fresh conversation")
+                
+                # 1-5 HOUR FOLLOW-UP WINDOW: Add personalization if between 1-5 hours
+                elif time_diff >= timedelta(hours=1) and time_diff <= timedelta(hours=5):
+                    minutes_ago = int(time_diff.total_seconds() / 60)
+                    # Add marker that will be detected by persona_architect
+                    user_message_to_send = f"[FOLLOW_UP:{minutes_ago}min] {request.message}"
+                    print(f"💭 Follow-up detected - last chat {minutes_ago} minutes ago")
+                
+                # < 1 HOUR: Normal flow with chat history (no special follow-up)
+                
+            except Exception as e:
+                print(f"⚠️ Error parsing timestamp for time-based features: {e}")
+    
+    print(f"💡 Loaded {len(key_insights)} key insights and {len(recent_history)} recent messages for context")
+    return persona, key_insights, recent_history, older_history, user_full_name, user_message_to_send
+
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
@@ -543,94 +757,18 @@ async def chat(
     try:
         print(f"💬 Processing chat for user {request.user_id}...")
 
-        # Check if Google API key is set
-        if not GOOGLE_API_KEY:
-            raise HTTPException(
-                status_code=500,
-                detail="Google API key not configured on server"
-            )
-
-        # Validate message
-        if not request.message or not request.message.strip():
-            raise HTTPException(
-                status_code=400,
-                detail="Message cannot be empty"
-            )
-        
-        # ⚡ Fetch persona, key insights, chat history, and full name in parallel (non-blocking)
-        loop = asyncio.get_event_loop()
-        persona, key_insights, chat_history, user_full_name = await asyncio.gather(
-            loop.run_in_executor(None, firebase_service.get_user_persona, request.user_id),
-            loop.run_in_executor(None, firebase_service.get_relevant_insights, request.user_id, 5),
-            loop.run_in_executor(None, firebase_service.get_chat_history, request.user_id, 10),
-            loop.run_in_executor(None, firebase_service.get_user_full_name, request.user_id)
-        )
-        
-        if not persona:
-            raise HTTPException(
-                status_code=404,
-                detail=f"No persona found for user {request.user_id}. Generate persona first."
-            )
-        
-        # Get last 5 messages for context
-        recent_history = chat_history[-5:] if len(chat_history) > 5 else chat_history
-        
-        # ⏰ TIME-BASED CHAT FEATURES
-        # 1. Check if last chat was > 5 hours ago → reset to fresh conversation
-        # 2. Check if last chat was < 1 hour ago → add follow-up personalization
-        user_message_to_send = request.message
-        
-        if chat_history and len(chat_history) > 0:
-            # Get timestamp from most recent message
-            last_msg_timestamp = chat_history[-1].get('timestamp', '')
-            
-            if last_msg_timestamp:
-                from datetime import datetime, timedelta, timezone
-                try:
-                    # Parse ISO timestamp with timezone
-                    if last_msg_timestamp.endswith('Z'):
-                        last_time = datetime.fromisoformat(last_msg_timestamp.replace('Z', '+00:00'))
-                    else:
-                        last_time = datetime.fromisoformat(last_msg_timestamp)
-                    
-                    # Get current time in same timezone
-                    if last_time.tzinfo:
-                        now = datetime.now(last_time.tzinfo)
-                    else:
-                        now = datetime.now()
-                    
-                    time_diff = now - last_time
-                    hours_ago = time_diff.total_seconds() / 3600
-                    
-                    # 5-HOUR RESET WINDOW: Start fresh if > 5 hours
-                    if time_diff > timedelta(hours=5):
-                        recent_history = []  # Ignore old history
-                        print(f"⏰ Last chat was {hours_ago:.1f} hours ago - starting fresh conversation")
-                    
-                    # 1-5 HOUR FOLLOW-UP WINDOW: Add personalization if between 1-5 hours
-                    elif time_diff >= timedelta(hours=1) and time_diff <= timedelta(hours=5):
-                        minutes_ago = int(time_diff.total_seconds() / 60)
-                        # Add marker that will be detected by persona_architect
-                        user_message_to_send = f"[FOLLOW_UP:{minutes_ago}min] {request.message}"
-                        print(f"💭 Follow-up detected - last chat {minutes_ago} minutes ago")
-                    
-                    # < 1 HOUR: Normal flow with chat history (no special follow-up)
-                    
-                except Exception as e:
-                    print(f"⚠️ Error parsing timestamp for time-based features: {e}")
-        
-        print(f"💡 Loaded {len(key_insights)} key insights and {len(recent_history)} recent messages for context")
+        persona, key_insights, recent_history, older_history, user_full_name, user_message_to_send = await load_chat_context(request)
         
         # ⚡ UNIFIED: Single LLM call returns both response + tool recommendations
         # Returns tuple: (response_text, recommended_tools_dict)
         start_time = time.time()
         
-        ai_response, recommended_tools = persona_architect.chat(
-            user_message=user_message_to_send,
-            persona=persona,
-            chat_history=recent_history,
-            key_insights=key_insights,
-            user_full_name=user_full_name
+        ai_response, recommended_tools = await persona_architect.achat(
+            user_message_to_send,
+            persona,
+            recent_history,
+            key_insights,
+            user_full_name
         )
         
         ai_time = time.time() - start_time
@@ -650,7 +788,8 @@ async def chat(
             ai_response=ai_response,
             recommended_tools=recommended_tools,
             persona=persona,
-            model_name=MODEL_NAME
+            model_name=MODEL_NAME,
+            older_history=older_history
         )
         
         print(f"⚡ Response returned immediately - saving in background")
@@ -673,6 +812,66 @@ async def chat(
         )
 
 
+@app.post("/api/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    background_tasks: BackgroundTasks,
+    authenticated_uid: str = Depends(get_authenticated_uid),
+):
+    """
+    Streaming variant of /api/chat: the reply appears as Gemini writes it.
+    
+    Returns Server-Sent Events: `{"delta": "..."}` events carrying reply text,
+    then a final `{"done": true, "response": "...", "recommended_tools": {...}}`
+    event once tool scores are parsed from the full output. Messages are saved
+    and state is updated in the background after the stream closes, as in /api/chat.
+    """
+    require_matching_user(request.user_id, authenticated_uid)
+    
+    print(f"💬 Streaming chat for user {request.user_id}...")
+    persona, key_insights, recent_history, older_history, user_full_name, user_message_to_send = await load_chat_context(request)
+    
+    async def event_stream():
+        start_time = time.time()
+        first_token_time = None
+        async for item in persona_architect.achat_stream(
+            user_message_to_send,
+            persona,
+            recent_history,
+            key_insights,
+            user_full_name
+        ):
+            if isinstance(item, str):
+                if first_token_time is None:
+                    first_token_time = time.time() - start_time
+                yield b"data: " + orjson.dumps({"delta": item}) + b"\n\n"
+                continue
+            
+            ai_response, recommended_tools = item
+            recommended_tools = {k: int(v) for k, v in recommended_tools.items()}
+            
+            ai_time = time.time() - start_time
+            print(f"⏱️ AI response streamed in {ai_time:.2f}s (first token {(first_token_time or ai_time)*1000:.0f}ms)")
+            print(f"🔧 Tool recommendations: {recommended_tools}")
+            
+            # Runs after the stream closes (same BackgroundTasks the response holds)
+            background_tasks.add_task(
+                save_chat_and_update_state,
+                user_id=request.user_id,
+                user_message=request.message,
+                ai_response=ai_response,
+                recommended_tools=recommended_tools,
+                persona=persona,
+                model_name=MODEL_NAME,
+                older_history=older_history
+            )
+            
+            final_event = {"done": True, "response": ai_response, "recommended_tools": recommended_tools}
+            yield b"data: " + orjson.dumps(final_event) + b"\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 # ============================================================================
 # CHAT HISTORY ENDPOINT
 # ============================================================================
@@ -844,7 +1043,8 @@ async def get_stats():
         stats = firebase_service.get_persona_stats()
         return {
             "success": True,
-            "stats": stats
+            "stats": stats,
+            "persona_cache": persona_architect.persona_cache.stats()
         }
     except Exception as e:
         return {
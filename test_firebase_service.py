@@ -0,0 +1,162 @@
+"""
+Offline tests for FirebaseService write paths, against an in-memory stand-in
+for the Firestore client (no credentials or network needed).
+
+Run with: python -m pytest test_firebase_service.py (or python -m unittest)
+"""
+import threading
+import unittest
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import firebase_admin
+from firebase_admin import firestore
+
+from conftest import make_architect, make_persona
+from langchain_persona_architect import Mood
+
+
+class FakeDocument:
+    def __init__(self, doc_id, data=None):
+        self.id = doc_id
+        self.data = data or {}
+        self.updates = []
+
+    @property
+    def exists(self):
+        return bool(self.data)
+
+    def get(self):
+        return self
+
+    def update(self, updates):
+        self.updates.append(updates)
+
+    def to_dict(self):
+        return dict(self.data)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+
+    def document(self, doc_id):
+        return self.docs.setdefault(doc_id, FakeDocument(doc_id))
+
+    def stream(self):
+        return iter(self.docs.values())
+
+
+class FakeDb:
+    def __init__(self):
+        self.collections = {}
+
+    def collection(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+
+# firebase_service builds its singleton at import; let it find an "initialised"
+# app and the in-memory client instead of real credentials
+with mock.patch.dict(firebase_admin._apps, {"[DEFAULT]": object()}), \
+        mock.patch.object(firestore, "client", FakeDb):
+    from firebase_service import FirebaseService
+
+
+def make_service() -> FirebaseService:
+    """FirebaseService wired to FakeDb, skipping Firebase Admin initialisation"""
+    service = object.__new__(FirebaseService)
+    service.db = FakeDb()
+    service._persona_cache = OrderedDict()
+    service._persona_cache_lock = threading.Lock()
+    return service
+
+
+class UpdateLiveStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = make_service()
+        self.persona = make_persona(recent_stressors=["exams"])
+
+    def _written(self):
+        return self.service.db.collection("user_persona").document("user-1").updates
+
+    def test_writes_only_changed_fields_as_dotted_paths(self):
+        state = self.persona.live_user_state
+        previous = state.model_dump(mode="json")
+        make_architect().update_user_state(
+            state, {"type": "chat_message", "content": "stress again", "mood": "anxious"}
+        )
+
+        self.assertTrue(self.service.update_live_state("user-1", state, previous))
+        (updates,) = self._written()
+        self.assertIs(updates.pop("updated_at"), firestore.SERVER_TIMESTAMP)
+        self.assertEqual(updates, {
+            "live_user_state.current_mood": "anxious",
+            "live_user_state.chat_message_count": firestore.Increment(1),
+            "live_user_state.last_interaction": "chat",
+            "live_user_state.recent_stressors": ["exams", "general stress"],
+            "live_user_state.last_interaction_timestamp": state.last_interaction_timestamp,
+            "live_user_state.last_updated": state.last_updated,
+        })
+
+    def test_writes_whole_state_without_previous_snapshot(self):
+        state = self.persona.live_user_state
+        self.assertTrue(self.service.update_live_state("user-1", state))
+        (updates,) = self._written()
+        self.assertEqual(updates["live_user_state"], state.model_dump(mode="json"))
+
+    def test_refreshes_cached_persona(self):
+        self.service._cache_persona(self.persona)
+        state = self.persona.live_user_state.model_copy(deep=True)
+        state.current_mood = Mood.TIRED
+        self.service.update_live_state("user-1", state, self.persona.live_user_state.model_dump(mode="json"))
+        self.assertEqual(self.service._get_cached_persona("user-1").live_user_state.current_mood, Mood.TIRED)
+
+    def test_failed_write_drops_cached_persona(self):
+        self.service._cache_persona(self.persona)
+        self.service.db.collection("user_persona").document("user-1").update = mock.Mock(
+            side_effect=RuntimeError("deadline exceeded")
+        )
+        self.assertFalse(self.service.update_live_state("user-1", self.persona.live_user_state))
+        self.assertIsNone(self.service._get_cached_persona("user-1"))
+
+
+class GetUserPersonaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.service = make_service()
+        self.stored = self.service.db.collection("user_persona").document("user-1")
+        self.stored.data = make_persona(chat_message_count=7).model_dump(mode="json")
+        self.service._cache_persona(make_persona(chat_message_count=3))
+
+    def test_serves_cached_copy_by_default(self):
+        self.assertEqual(self.service.get_user_persona("user-1").live_user_state.chat_message_count, 3)
+
+    def test_uncached_read_goes_to_firestore_and_refreshes_cache(self):
+        persona = self.service.get_user_persona("user-1", use_cache=False)
+        self.assertEqual(persona.live_user_state.chat_message_count, 7)
+        self.assertEqual(self.service._get_cached_persona("user-1").live_user_state.chat_message_count, 7)
+
+
+class PersonaStatsTest(unittest.TestCase):
+
+    def test_counts_naive_and_aware_generated_at(self):
+        service = make_service()
+        personas = service.db.collection("user_persona")
+        now = datetime.now(timezone.utc)
+        stamps = {
+            "aware-recent": (now - timedelta(hours=1)).isoformat(),
+            "naive-recent": (now - timedelta(hours=2)).replace(tzinfo=None).isoformat(),
+            "aware-old": (now - timedelta(days=3)).isoformat(),
+        }
+        for user_id, stamp in stamps.items():
+            personas.docs[user_id] = FakeDocument(user_id, {"personality_profile": {"generated_at": stamp}})
+
+        stats = service.get_persona_stats()
+        self.assertEqual(stats["total_personas"], 3)
+        self.assertEqual(stats["recent_24h"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,571 @@
+"""
+Offline tests for LangChainPersonaArchitect (no Gemini or Firebase calls).
+
+The live-state handlers, sentiment rules and keyword fallback replaced
+hand-written if/elif code; each is checked against a reference copy of the original branches so a
+table edit cannot silently change behaviour.
+
+Run with: python -m pytest test_persona_architect.py (or python -m unittest)
+"""
+import asyncio
+import itertools
+import random
+import unittest
+from unittest import mock
+
+from langchain_core.language_models.fake_chat_models import (
+    FakeListChatModel,
+    GenericFakeChatModel,
+)
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.runnables import RunnableLambda
+
+import langchain_persona_architect as lpa
+from conftest import PROFILE, QUIZ, make_architect, make_persona
+from langchain_persona_architect import LiveUserState, Mood, PersonaCache, PersonalityProfile
+
+
+# ============================================================================
+# REFERENCE IMPLEMENTATIONS - The original if/elif branches
+# ============================================================================
+
+def _baseline_push(items, value):
+    if value not in items:
+        items.append(value)
+        if len(items) > 5:
+            items.pop(0)
+
+
+def _baseline_set_mood(state, value):
+    if value:
+        try:
+            state.current_mood = Mood(value)
+        except ValueError:
+            pass
+
+
+def baseline_update_user_state(state, action):
+    action_type = action.get("type", "unknown").lower()
+    content = action.get("content", {})
+
+    if action_type == "chat_message":
+        state.chat_message_count += 1
+        state.last_interaction = "chat"
+        if "mood" in action:
+            _baseline_set_mood(state, action["mood"])
+        if "content" in action and "stress" in action["content"].lower():
+            _baseline_push(state.recent_stressors, action.get("stressor_detected", "general stress"))
+
+    elif action_type == "tool_use":
+        state.tool_usage_count += 1
+        state.last_interaction = "tool_use"
+        _baseline_push(state.coping_successes, f"Used {action.get('tool_name', 'unknown tool')}")
+
+    elif action_type == "sleep_log":
+        state.sleep_logs_count += 1
+        state.last_interaction = "sleep_log"
+        if action.get("hours", 7) < 5 or action.get("quality", "good") in ["poor", "very poor"]:
+            state.needs_check_in = True
+
+    elif action_type == "breathing_exercise":
+        state.tool_usage_count += 1
+        state.last_interaction = "breathing_exercise"
+        _baseline_set_mood(state, content.get("afterMood", "").lower())
+        technique = content.get("technique", "Breathing Exercise")
+        if content.get("moodImprovement", "") == "Improved":
+            _baseline_push(state.coping_successes, f"{technique} - Improved mood")
+            state.needs_check_in = False
+        if content.get("sessionQuality", "") == "Needs Improvement" or (
+            not content.get("completed", False) and content.get("pausedTimes", 0) > 3
+        ):
+            state.needs_check_in = True
+            _baseline_push(state.recent_stressors, f"Difficulty with {technique}")
+
+    elif action_type == "grounding_technique":
+        state.tool_usage_count += 1
+        state.last_interaction = "grounding_technique"
+        _baseline_set_mood(state, content.get("afterMood", "").lower())
+        technique_used = content.get("techniqueUsed", "Grounding Technique")
+        if content.get("moodImprovement", "") == "Improved":
+            _baseline_push(state.coping_successes, f"{technique_used} - Helped with grounding")
+            state.needs_check_in = False
+        if content.get("currentStressLevel", "") in ["High", "Very High"]:
+            state.needs_check_in = True
+            environment = content.get("environmentType", "general situation")
+            _baseline_push(state.recent_stressors, f"High stress in {environment}")
+
+    elif action_type == "mindfulness_meditation":
+        state.tool_usage_count += 1
+        state.last_interaction = "mindfulness_meditation"
+        _baseline_set_mood(state, content.get("moodAfter", "").lower())
+        technique_used = content.get("techniqueUsed", "Meditation")
+        if content.get("moodImprovement", "") == "Improved" or content.get("sessionQuality", "") == "Excellent":
+            _baseline_push(state.coping_successes, f"{technique_used} meditation")
+            state.needs_check_in = False
+        if (
+            not content.get("completed", False)
+            and content.get("pauseCount", 0) > 2
+            and float(content.get("completionRate", 100)) < 50
+        ):
+            state.needs_check_in = True
+            _baseline_push(state.recent_stressors, f"Difficulty maintaining focus during {technique_used}")
+
+    elif action_type == "body_relaxation":
+        state.tool_usage_count += 1
+        state.last_interaction = "body_relaxation"
+        _baseline_set_mood(state, content.get("moodAfter", "").lower())
+        tool_used = content.get("toolUsed", "Body Relaxation")
+        if content.get("moodImprovement", "") == "Improved" or content.get("sessionQuality", "") == "Excellent":
+            _baseline_push(state.coping_successes, f"{tool_used}")
+            state.needs_check_in = False
+        if tool_used == "Body Mapping" and content.get("hasVeryTenseTensionAreas", False):
+            _baseline_push(state.recent_stressors, "Significant body tension detected")
+
+    return state
+
+
+def baseline_sentiment(state, key_insights=None):
+    mood = state.current_mood.value
+    needs_support = state.needs_check_in
+    has_stressors = len(state.recent_stressors) > 0
+    has_successes = len(state.coping_successes) > 0
+    crisis_indicators = any(
+        insight.get("type") in ["crisis", "severe_stress", "self_harm"] for insight in key_insights or []
+    )
+
+    if crisis_indicators or mood in ["sad", "anxious"] and needs_support:
+        return lpa._SENTIMENT_SUPPORT
+    elif mood == "anxious" or "anxiety" in str(state.recent_stressors).lower():
+        return lpa._SENTIMENT_ANXIOUS
+    elif mood == "stressed":
+        return lpa._SENTIMENT_STRESSED
+    elif mood == "tired" or "sleep" in str(state.recent_stressors).lower():
+        return lpa._SENTIMENT_EXHAUSTED
+    elif mood in ["happy", "motivated"] or has_successes:
+        return lpa._SENTIMENT_POSITIVE
+    elif mood == "neutral" and not needs_support:
+        return lpa._SENTIMENT_NEUTRAL
+    elif has_stressors and not has_successes:
+        return lpa._SENTIMENT_STRUGGLING
+    return lpa._SENTIMENT_NEW_USER
+
+
+def baseline_keyword_tools(architect, text):
+    tools = architect._get_default_tools()
+    text_lower = text.lower()
+    for tool_key, keywords in lpa._TOOL_KEYWORD_SCORES.items():
+        max_score = 0.0
+        for keyword, score in keywords:
+            if keyword in text_lower:
+                max_score = max(max_score, score)
+        tools[tool_key] = max_score
+
+    if any(word in text_lower for word in ["anxiety", "anxious", "panic", "overwhelm"]):
+        if tools["pursed_lip_breathing"] < 50:
+            tools["pursed_lip_breathing"] = max(tools["pursed_lip_breathing"], 60.0)
+        if tools["five_four_three_two_one"] < 50:
+            tools["five_four_three_two_one"] = max(tools["five_four_three_two_one"], 55.0)
+    if any(word in text_lower for word in ["sleep", "rest", "tired", "exhausted"]):
+        if tools["four_seven_eight_breathing"] < 50:
+            tools["four_seven_eight_breathing"] = max(tools["four_seven_eight_breathing"], 65.0)
+        if tools["body_scan_meditation"] < 50:
+            tools["body_scan_meditation"] = max(tools["body_scan_meditation"], 60.0)
+    if any(word in text_lower for word in ["tension", "tight", "tense", "body"]):
+        if tools["body_mapping"] < 50:
+            tools["body_mapping"] = max(tools["body_mapping"], 60.0)
+    return tools
+
+
+# ============================================================================
+# LIVE STATE UPDATES
+# ============================================================================
+
+_STATE_FIELDS_COMPARED = {
+    "current_mood", "last_interaction", "chat_message_count", "tool_usage_count",
+    "sleep_logs_count", "recent_stressors", "coping_successes", "needs_check_in",
+}
+
+
+def _state_actions():
+    """A grid of app actions covering every branch of every handler"""
+    moods = ["Happy", "tired", "not-a-mood", ""]
+    yield {"type": "unknown"}
+    for mood, text in itertools.product(["sad", "bogus"], ["so much STRESS today", "all good"]):
+        yield {"type": "chat_message", "mood": mood, "content": text}
+        yield {"type": "chat_message", "content": text, "stressor_detected": "exams"}
+    yield {"type": "Tool_Use", "tool_name": "Box Breathing"}
+    yield {"type": "tool_use"}
+    for hours, quality in itertools.product([4, 8], ["good", "poor", "very poor"]):
+        yield {"type": "sleep_log", "hours": hours, "quality": quality}
+    for mood, improvement, quality, completed, paused in itertools.product(
+        moods, ["Improved", "Same"], ["Needs Improvement", "Good"], [True, False], [0, 4]
+    ):
+        yield {"type": "breathing_exercise", "content": {
+            "afterMood": mood, "technique": "Box", "moodImprovement": improvement,
+            "sessionQuality": quality, "completed": completed, "pausedTimes": paused,
+        }}
+    for mood, improvement, level in itertools.product(moods, ["Improved", "Same"], ["High", "Very High", "Low"]):
+        yield {"type": "grounding_technique", "content": {
+            "afterMood": mood, "techniqueUsed": "5-4-3-2-1", "moodImprovement": improvement,
+            "currentStressLevel": level, "environmentType": "class",
+        }}
+    yield {"type": "grounding_technique", "content": {"currentStressLevel": "High"}}
+    for mood, improvement, quality, completed, pauses, rate in itertools.product(
+        moods, ["Improved", "Same"], ["Excellent", "Fair"], [True, False], [1, 3], [30, "80"]
+    ):
+        yield {"type": "mindfulness_meditation", "content": {
+            "moodAfter": mood, "techniqueUsed": "Body Scan", "moodImprovement": improvement,
+            "sessionQuality": quality, "completed": completed, "pauseCount": pauses,
+            "completionRate": rate,
+        }}
+    for mood, tool, quality, tense in itertools.product(
+        moods, ["Body Mapping", "Self-Hug"], ["Excellent", "Fair"], [True, False]
+    ):
+        yield {"type": "body_relaxation", "content": {
+            "moodAfter": mood, "toolUsed": tool, "sessionQuality": quality,
+            "hasVeryTenseTensionAreas": tense,
+        }}
+
+
+def _starting_states():
+    yield LiveUserState.fresh()
+    yield LiveUserState.fresh(
+        current_mood=Mood.ANXIOUS,
+        needs_check_in=True,
+        recent_stressors=["s1", "s2", "s3", "s4", "Difficulty with Box"],
+        coping_successes=["c1", "c2", "c3", "c4", "Used Box Breathing"],
+    )
+
+
+class UpdateUserStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.architect = make_architect()
+
+    def test_handlers_match_original_branches(self):
+        for start, action in itertools.product(list(_starting_states()), list(_state_actions())):
+            if action["type"] == "chat_message" and "stressor_detected" in action \
+                    and "stress" not in action["content"].lower():
+                continue  # Intentional change, covered below
+            with self.subTest(action=action, start=start.recent_stressors):
+                expected = baseline_update_user_state(start.model_copy(deep=True), action)
+                actual = self.architect.update_user_state(start.model_copy(deep=True), action)
+                self.assertEqual(
+                    actual.model_dump(include=_STATE_FIELDS_COMPARED),
+                    expected.model_dump(include=_STATE_FIELDS_COMPARED),
+                )
+
+    def test_detected_stressor_is_kept_without_keyword(self):
+        state = self.architect.update_user_state(
+            LiveUserState.fresh(),
+            {"type": "chat_message", "content": "exams next week", "stressor_detected": "exams"},
+        )
+        self.assertEqual(state.recent_stressors, ["exams"])
+
+    def test_timestamps_share_one_clock_read(self):
+        state = self.architect.update_user_state(LiveUserState.fresh(), {"type": "tool_use"})
+        self.assertEqual(state.last_interaction_timestamp, state.last_updated)
+        self.assertTrue(state.last_updated.endswith("+00:00"))
+
+
+class LiveUserStateDefaultsTest(unittest.TestCase):
+
+    def test_missing_timestamps_share_one_clock_read(self):
+        state = LiveUserState()
+        self.assertEqual(state.last_interaction_timestamp, state.last_updated)
+        self.assertTrue(state.last_updated.endswith("+00:00"))
+
+    def test_loads_documents_without_timestamps(self):
+        state = LiveUserState.model_validate({"current_mood": "tired", "last_updated": "2026-01-01T00:00:00+00:00"})
+        self.assertEqual(state.current_mood, Mood.TIRED)
+        self.assertEqual(state.last_updated, "2026-01-01T00:00:00+00:00")
+        self.assertTrue(state.last_interaction_timestamp.endswith("+00:00"))
+
+
+class PushUniqueTest(unittest.TestCase):
+
+    def test_skips_duplicates(self):
+        items = ["a", "b"]
+        lpa._push_unique(items, "a")
+        self.assertEqual(items, ["a", "b"])
+
+    def test_drops_oldest_beyond_limit(self):
+        items = ["a", "b", "c", "d", "e"]
+        lpa._push_unique(items, "f")
+        self.assertEqual(items, ["b", "c", "d", "e", "f"])
+
+    def test_custom_limit(self):
+        items = ["a", "b"]
+        lpa._push_unique(items, "c", limit=2)
+        self.assertEqual(items, ["b", "c"])
+
+
+# ============================================================================
+# SENTIMENT GUIDANCE
+# ============================================================================
+
+class SentimentRulesTest(unittest.TestCase):
+
+    def test_rules_match_original_branches(self):
+        architect = make_architect()
+        stressor_sets = [[], ["exams"], ["Anxiety about exams"], ["poor SLEEP"], ["can't sleep", "anxiety"]]
+        insight_sets = [None, [], [{"type": "stressor"}], [{"type": "note"}, {"type": "self_harm"}]]
+        for mood, check_in, stressors, successes, insights in itertools.product(
+            Mood, [True, False], stressor_sets, [[], ["Used Box Breathing"]], insight_sets
+        ):
+            state = LiveUserState.fresh(
+                current_mood=mood, needs_check_in=check_in,
+                recent_stressors=list(stressors), coping_successes=list(successes),
+            )
+            with self.subTest(mood=mood, check_in=check_in, stressors=stressors,
+                              successes=successes, insights=insights):
+                self.assertIs(
+                    architect._analyze_user_sentiment(state, insights),
+                    baseline_sentiment(state, insights),
+                )
+
+
+# ============================================================================
+# KEYWORD TOOL FALLBACK
+# ============================================================================
+
+class KeywordFallbackTest(unittest.TestCase):
+
+    def test_single_pass_scan_matches_per_keyword_scan(self):
+        architect = make_architect()
+        phrases = [keyword for keywords in lpa._TOOL_KEYWORD_SCORES.values() for keyword, _ in keywords]
+        words = phrases + [
+            "anxious", "panic", "rest", "tired", "tense", "body", "I", "feel", "today", "the",
+            "Wave", "BREATHING", "texture", "scan", "mindful", "",
+        ]
+        rng = random.Random(7)
+        for _ in range(3000):
+            text = rng.choice([" ", "", "-"]).join(rng.choice(words) for _ in range(rng.randint(0, 8)))
+            with self.subTest(text=text):
+                self.assertEqual(
+                    architect._legacy_fallback_tool_extraction(text),
+                    baseline_keyword_tools(architect, text),
+                )
+
+    def test_prefix_invariant_holds_for_table(self):
+        lpa._check_keyword_prefixes()
+
+    def test_prefix_invariant_rejects_hiding_phrase(self):
+        hits = dict(lpa._TOOL_KEYWORD_HITS, **{"texture focus": [("box_breathing", 95.0)]})
+        with mock.patch.object(lpa, "_TOOL_KEYWORD_HITS", hits):
+            with self.assertRaises(ValueError):
+                lpa._check_keyword_prefixes()
+
+
+# ============================================================================
+# PERSONA CACHE
+# ============================================================================
+
+class PersonaCacheTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = PersonaCache(max_entries=2)
+        cache.set("a", {"v": 1})
+        cache.set("b", {"v": 2})
+        cache.get("a")
+        cache.set("c", {"v": 3})
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), {"v": 1})
+        self.assertEqual(cache.get("c"), {"v": 3})
+
+    def test_entries_expire_after_ttl(self):
+        cache = PersonaCache(ttl_seconds=10)
+        with mock.patch.object(lpa.time, "monotonic", return_value=100.0):
+            cache.set("a", {"v": 1})
+        with mock.patch.object(lpa.time, "monotonic", return_value=109.0):
+            self.assertEqual(cache.get("a"), {"v": 1})
+        with mock.patch.object(lpa.time, "monotonic", return_value=111.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_returns_isolated_copies(self):
+        cache = PersonaCache()
+        stored = {"strengths": ["a"]}
+        cache.set("a", stored)
+        stored["strengths"].append("mutated")
+        cache.get("a")["strengths"].append("mutated")
+        self.assertEqual(cache.get("a"), {"strengths": ["a"]})
+
+    def test_stats_count_hits_and_misses(self):
+        cache = PersonaCache()
+        cache.get("missing")
+        cache.set("a", {})
+        cache.get("a")
+        self.assertEqual(cache.stats(), {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5})
+
+    def test_identical_quiz_skips_the_llm(self):
+        architect = make_architect()
+        calls = []
+
+        class Chain:
+            def invoke(self, quiz_text):
+                calls.append(quiz_text)
+                return PersonalityProfile(**PROFILE)
+
+        architect.chain = Chain()
+        first = architect.generate_persona("u1", QUIZ)
+        second = architect.generate_persona("u2", dict(reversed(list(QUIZ.items()))))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(second.user_id, "u2")
+        self.assertEqual(
+            second.personality_profile.model_dump(exclude={"generated_at"}),
+            first.personality_profile.model_dump(exclude={"generated_at"}),
+        )
+
+    def test_cache_key_tracks_prompt_inputs(self):
+        architect = make_architect()
+        key = architect._persona_cache_key(QUIZ)
+        self.assertEqual(key, architect._persona_cache_key({str(q): a for q, a in QUIZ.items()}))
+        self.assertNotEqual(key, architect._persona_cache_key({**QUIZ, 1: "b"}))
+        with mock.patch.object(lpa, "PROMPT_VERSION", "test-version"):
+            self.assertNotEqual(key, architect._persona_cache_key(QUIZ))
+
+
+# ============================================================================
+# STRUCTURED OUTPUT
+# ============================================================================
+
+class StructuredOutputFallbackTest(unittest.TestCase):
+
+    def _structured(self, json_schema_step):
+        """_structured_llm over a stub whose json_schema and function-calling paths are lambdas"""
+        self.fallback_calls = []
+
+        def function_calling_step(_):
+            self.fallback_calls.append(1)
+            return PersonalityProfile(**PROFILE)
+
+        llm = mock.Mock()
+        llm.with_structured_output.side_effect = lambda schema, method: RunnableLambda(
+            json_schema_step if method == "json_schema" else function_calling_step
+        )
+        return make_architect()._structured_llm(PersonalityProfile, llm)
+
+    def test_uses_json_schema_result(self):
+        profile = self._structured(lambda _: dict(PROFILE)).invoke("quiz")
+        self.assertEqual(profile.chatbot_tone, "calm")
+        self.assertEqual(self.fallback_calls, [])
+
+    def test_invalid_profile_falls_back_to_function_calling(self):
+        profile = self._structured(lambda _: {"chatbot_tone": "calm"}).invoke("quiz")
+        self.assertIsInstance(profile, PersonalityProfile)
+        self.assertEqual(self.fallback_calls, [1])
+
+    def test_api_errors_propagate_without_a_second_call(self):
+        def rate_limited(_):
+            raise RuntimeError("429 RESOURCE_EXHAUSTED")
+
+        with self.assertRaises(RuntimeError):
+            self._structured(rate_limited).invoke("quiz")
+        self.assertEqual(self.fallback_calls, [])
+
+
+# ============================================================================
+# CHAT STREAMING AND SUMMARY
+# ============================================================================
+
+class ChatStreamTest(unittest.TestCase):
+
+    def _collect(self, architect):
+        async def run():
+            return [item async for item in architect.achat_stream("hello", make_persona(), user_full_name="Asha")]
+        return asyncio.run(run())
+
+    def test_deltas_rebuild_the_final_reply(self):
+        architect = make_architect()
+        reply = '{"response": "Hi Asha, try a slow breath with me.", "recommended_tools": {"box_breathing": 140}}'
+        architect.chat_llm = GenericFakeChatModel(messages=iter([AIMessage(content=reply)]))
+        items = self._collect(architect)
+
+        deltas, (response, tools) = items[:-1], items[-1]
+        self.assertGreater(len(deltas), 1)
+        self.assertTrue(all(isinstance(delta, str) for delta in deltas))
+        self.assertEqual("".join(deltas), "Hi Asha, try a slow breath with me.")
+        self.assertEqual(response, "Hi Asha, try a slow breath with me.")
+        self.assertEqual(tools["box_breathing"], 100.0)
+        self.assertEqual(set(tools), set(architect._get_default_tools()))
+
+    def test_cut_off_reply_keeps_text_and_scores_keywords(self):
+        architect = make_architect()
+        reply = '{"response": "Let us try box breathing together'
+        architect.chat_llm = GenericFakeChatModel(messages=iter([AIMessage(content=reply)]))
+        items = self._collect(architect)
+
+        response, tools = items[-1]
+        self.assertEqual("".join(items[:-1]), response)
+        self.assertEqual(response, "Let us try box breathing together")
+        self.assertEqual(tools["box_breathing"], 95.0)
+
+    def _failing_stream(self, *chunks):
+        class FailingChatModel:
+            async def astream(self, messages):
+                for chunk in chunks:
+                    yield AIMessageChunk(content=chunk)
+                raise RuntimeError("connection reset")
+        return FailingChatModel()
+
+    def test_failure_after_deltas_finishes_with_partial_text(self):
+        architect = make_architect()
+        architect.chat_llm = self._failing_stream('{"response": "Let us try ', 'box breathing')
+        items = self._collect(architect)
+
+        response, tools = items[-1]
+        self.assertEqual("".join(items[:-1]), "Let us try box breathing")
+        self.assertEqual(response, "Let us try box breathing")
+        self.assertEqual(tools["box_breathing"], 95.0)
+
+    def test_failure_before_any_text_sends_fallback_reply(self):
+        architect = make_architect()
+        architect.chat_llm = self._failing_stream()
+        items = self._collect(architect)
+
+        self.assertEqual(items[-1], ("I'm here with you.", architect._get_default_tools()))
+        self.assertEqual(items[:-1], ["I'm here with you."])
+
+
+class SummarizeHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.architect = make_architect()
+        self.architect.summary_llm = FakeListChatModel(responses=["first summary", "second summary"])
+
+    def _messages(self, start, count):
+        return [
+            {"role": "user", "content": f"message {i}", "timestamp": f"2026-01-{i:02d}T10:00:00+05:30"}
+            for i in range(start, start + count)
+        ]
+
+    def test_advances_watermark_and_skips_summarized_turns(self):
+        state = LiveUserState.fresh()
+        older = self._messages(1, 4)
+        self.assertTrue(self.architect.summarize_history(state, older))
+        self.assertEqual(state.conversation_summary, "first summary")
+        self.assertEqual(state.summarized_through, "2026-01-04T10:00:00+05:30")
+
+        # Same window again: nothing new to fold in
+        self.assertFalse(self.architect.summarize_history(state, older))
+
+        self.assertTrue(self.architect.summarize_history(state, older + self._messages(5, 4)))
+        self.assertEqual(state.conversation_summary, "second summary")
+        self.assertEqual(state.summarized_through, "2026-01-08T10:00:00+05:30")
+
+    def test_waits_for_enough_new_turns(self):
+        state = LiveUserState.fresh()
+        self.assertFalse(self.architect.summarize_history(state, self._messages(1, 3)))
+        self.assertEqual(state.summarized_through, "")
+
+    def test_ignores_messages_without_timestamp(self):
+        state = LiveUserState.fresh()
+        untimed = [{"role": "user", "content": "hi"}] * 6
+        self.assertFalse(self.architect.summarize_history(state, untimed))
+        self.assertTrue(self.architect.summarize_history(state, untimed + self._messages(1, 4)))
+        self.assertEqual(state.summarized_through, "2026-01-04T10:00:00+05:30")
+
+
+if __name__ == "__main__":
+    unittest.main()